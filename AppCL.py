@@ -1,20 +1,40 @@
 import time, os
+from decimal import Decimal
+from functools import partial
 
 import numpy as np
 
 from pygame.locals import *
 import pygame.freetype
 
-from CL.mandelbrot_func import create_and_build_program, create_out_array_and_buffer, create_cl_context_and_queue, calculate_mandelbrot_opencl
+from CL.mandelbrot_func import set_event_callback, create_and_build_program, create_cl_context_and_queue, calculate_mandelbrot_opencl, \
+    create_build_options, calculate_points_opencl, calculate_region_opencl, create_palette_buffer, colour_mandelbrot_opencl, \
+    split_float_float, SCALAR_ARG_TYPES_GPU, SCALAR_ARG_TYPES_CPU, SCALAR_ARG_TYPES_FLOAT_FLOAT, DEFAULT_LAUNCH
+from mariani_silver import mariani_silver
+from progressive import PROGRESSIVE_STEPS, refinement_points, fill_blocks
+from incremental_pan import shift_frame
+from capture import CAPTURE_BAND_HEIGHT, capture_bands, write_png, write_png_rgb, write_raw, get_surface_palette
+from supersample import supersample_bands
+from async_render import AsyncRenderer
+from profiling import stage, record_time, record_event, end_frame, get_stage_stats, open_profile_log, close_profile_log
+from tile_cache import TileCache, tiles_for_view, render_tiles, cache_frame, count_cached_tiles
+from CL.multi_device import get_all_devices, MultiDeviceRenderer
+from CL.launch_tuning import get_launch
+from CL.buffer_pool import BufferPool
+from CL.perturbation import SCALAR_ARG_TYPES_PERTURBATION, set_decimal_precision, compute_reference_orbit, create_orbit_buffer, get_perturbation_args, \
+    compute_series_approximation, get_series_probes
 
 # Mandelbrot dimensions
 SHAPE = WIDTH, HEIGHT = 1024, 1024
 CAPTURE_SHAPE = CAPTURE_WIDTH, CAPTURE_HEIGHT = 1024*4, 1024*4
+CAPTURE_FORMAT = 'png'
+# Png captures resample pixels on boundaries with this many jittered sub-samples per side, 1 turns it off
+CAPTURE_SUPERSAMPLE = 4
 XMIN, XMAX = -2, 2
 YMIN, YMAX = -2, 2
 
-# Mandelbrot scalars
-XOFFSET, YOFFSET = 0, 0
+# Mandelbrot scalars, offsets are Decimal so they can be resolved at any zoom
+XOFFSET, YOFFSET = Decimal(0), Decimal(0)
 XSCALE = YSCALE = 1
 DEPTH = 250
 Z_POWER = 2
@@ -26,37 +46,41 @@ PAN_STEP_DIVIDER = 5
 USE_MOUSE = False
 FONT_SIZE = 20
 DO_FULLSCREEN = True
+# Precision ladder, below each cutoff the next kernel takes over: float, float-float, double, then perturbation
 FLOAT_CUTOFF = 0.000001
-
-SCALAR_ARG_TYPES_GPU = [None,
-         np.float32,
-         np.float32,
-         np.float32,
-         np.float32,
-         np.int32,
-         np.int32,
-         np.float32,
-         np.float32,
-         np.float32,
-         np.float32,
-         np.int32,
-         np.float32,
-         np.float32]
-
-SCALAR_ARG_TYPES_CPU = [None,
-         np.double,
-         np.double,
-         np.double,
-         np.double,
-         np.int32,
-         np.int32,
-         np.double,
-         np.double,
-         np.double,
-         np.double,
-         np.int32,
-         np.double,
-         np.double]
+FLOAT_FLOAT_CUTOFF = 1e-10
+DEEP_ZOOM_CUTOFF = 1e-13
+# Stay on the gpu with float-float down to FLOAT_FLOAT_CUTOFF instead of moving to doubles on the cpu
+USE_FLOAT_FLOAT = True
+USE_SERIES_APPROXIMATION = True
+SERIES_TOLERANCE = 1e-12
+INTERIOR_CHECK = True
+PERIOD_TOLERANCE = 0.001
+SUBDIVIDE = False
+PROGRESSIVE = True
+USE_TILE_CACHE = True
+TILE_CACHE_BYTES = 256 * 1024**2
+TILE_CACHE_DIR = None
+# Counts the kernels write, np.uint16 or np.uint32 halve or quarter the transfers when DEPTH fits
+OUTPUT_DTYPE = np.int64
+# Colour the frame on the device and upload it straight to a surface, SMOOTH_COLOUR blends between palette entries
+COLOUR_ON_DEVICE = False
+SMOOTH_COLOUR = False
+PALETTE_SCALE = 1.0
+# Render full frames on a worker thread into back buffers, the last frame stays up until the next is done
+ASYNC_RENDER = True
+# Split renders across every OpenCL device, full frames by rows, progressive and subdivided passes by points
+# DEVICE_FISSION splits CPUs into sub-devices of that many cores
+MULTI_DEVICE = False
+DEVICE_FISSION = None
+# Time each stage of a frame, device stages from OpenCL profiling events, shown with P
+# PROFILE_LOG is a file for a line of json per frame, other profilers can attach with profiling.add_hook
+PROFILE = True
+PROFILE_LOG = None
+# Build a kernel variant for each depth, every depth change then builds (or loads) a program
+SPECIALISE_DEPTH = False
+# Time the work-group shapes for each device and kernel variant on its first full frame, the best is kept on disk
+AUTOTUNE_LAUNCH = True
 
 # Pygame colours definition
 BLACK = pygame.Color(0, 0, 0)
@@ -66,13 +90,47 @@ RED = pygame.Color(255, 0, 0)
 GREEN = pygame.Color(0, 196, 0)
 BLUE = pygame.Color(0, 0, 128)
 
-context_gpu, queue_gpu, device_gpu = create_cl_context_and_queue(use_gpu=True)
-# out_np, out_buf_gpu = create_out_array_and_buffer(context_gpu, SHAPE)
-program_gpu = create_and_build_program(context_gpu, "CL/kernel.c")
+# Kernel of each device mode: float, double, perturbation and float-float
+KERNEL_FILENAMES = ["CL/kernel.c", "CL/kernel_double.c", "CL/kernel_perturbation.c", "CL/kernel_float_float.c"]
+
+# Contexts and programs are only created the first time a device needs them, built binaries are cached on disk
+cl_devices = {}
+cl_programs = {}
+
+def get_cl_device(use_gpu):
+    if use_gpu not in cl_devices:
+        cl_devices[use_gpu] = create_cl_context_and_queue(use_gpu=use_gpu, profiling=PROFILE)
+    return cl_devices[use_gpu]
+
+def get_program(use_gpu, kernel_filename, options):
+    key = use_gpu, kernel_filename, tuple(options)
+    if key not in cl_programs:
+        context, _, _ = get_cl_device(use_gpu)
+        cl_programs[key] = create_and_build_program(context, kernel_filename, options)
+    return cl_programs[key]
+
+# One renderer across all the devices for each kernel and build options
+multi_renderers = {}
+
+def get_multi_renderer(kernel_filename, options, needs_double):
+    key = kernel_filename, tuple(options)
+    if key not in multi_renderers:
+        multi_renderers[key] = MultiDeviceRenderer(get_all_devices(fission=DEVICE_FISSION), kernel_filename, options, needs_double,
+                                                    PROFILE)
+    return multi_renderers[key]
+
+# Smooth colouring needs fractional counts, otherwise the compact OUTPUT_DTYPE is used
+def get_output_dtype():
+    return np.float32 if COLOUR_ON_DEVICE and SMOOTH_COLOUR else OUTPUT_DTYPE
+
+# Z_POWER and CUTOFF are fixed so they are always built in, DEPTH only when SPECIALISE_DEPTH as it changes
+def get_kernel_options():
+    return create_build_options(INTERIOR_CHECK, PERIOD_TOLERANCE, get_output_dtype(), COLOUR_ON_DEVICE and SMOOTH_COLOUR,
+                                Z_POWER, DEPTH if SPECIALISE_DEPTH else None, CUTOFF)
 
-context_cpu, queue_cpu, device_cpu = create_cl_context_and_queue(use_gpu=False)
-# _, out_buf_cpu = create_out_array_and_buffer(context_cpu, SHAPE, )
-program_cpu = create_and_build_program(context_cpu, "CL/kernel_double.c")
+tile_cache = TileCache(TILE_CACHE_BYTES, TILE_CACHE_DIR)
+# Frame and capture buffers no longer in use, kept for the next time a context needs the same shape and dtype
+buffer_pool = BufferPool()
 
 context = None
 queue = None
@@ -82,29 +140,137 @@ out_buf = None
 device = None
 scalar_arg_types = None
 device_using = None
+series_skip = 0
+multi_renderer = None
+colour_program = None
+rgba_np = None
+rgba_buf = None
+back_np = None
+back_buf = None
+back_rgba_np = None
+back_rgba_buf = None
+palette_buf = None
+
+# Count and colour buffers for the current context and SHAPE, a displayed and a back set for async renders
+# The last set goes back to buffer_pool, so resizing or switching device back and forth reuses them
+# Any render still pending is cancelled, the caller renders the view again
+def create_frame_buffers():
+    global out_np, out_buf, rgba_np, rgba_buf, back_np, back_buf, back_rgba_np, back_rgba_buf, palette_buf
+
+    if out_np is not None:
+        # An async render may still be writing the back set, it can't be handed back (and maybe released) until it's done
+        async_renderer.cancel()
+        async_renderer.wait()
+        for frame_np, frame_buf in ((out_np, out_buf), (back_np, back_buf), (rgba_np, rgba_buf), (back_rgba_np, back_rgba_buf)):
+            buffer_pool.put(frame_np, frame_buf)
+
+    out_np, out_buf = buffer_pool.get(context, SHAPE, dtype=get_output_dtype())
+    back_np, back_buf = buffer_pool.get(context, SHAPE, dtype=get_output_dtype())
+    # Row major RGBA, the layout pygame.image.frombuffer takes
+    rgba_np, rgba_buf = buffer_pool.get(context, (HEIGHT, WIDTH, 4), dtype=np.uint8)
+    back_rgba_np, back_rgba_buf = buffer_pool.get(context, (HEIGHT, WIDTH, 4), dtype=np.uint8)
+    palette_buf = create_palette_buffer(context, get_surface_palette())
+
+    # Reused buffers still hold an old frame, show black until the first render like new ones
+    out_np.fill(0)
+    rgba_np.fill(0)
+
+# The back buffers hold a finished async render, display them
+def swap_frame_buffers():
+    global out_np, out_buf, rgba_np, rgba_buf, back_np, back_buf, back_rgba_np, back_rgba_buf
+
+    out_np, out_buf, back_np, back_buf = back_np, back_buf, out_np, out_buf
+    rgba_np, rgba_buf, back_rgba_np, back_rgba_buf = back_rgba_np, back_rgba_buf, rgba_np, rgba_buf
 
 def set_device(mode):
-    global context, queue, program, out_buf, out_np, device, scalar_arg_types, device_using
+    global context, queue, program, device, scalar_arg_types, device_using, last_view, colour_program, multi_renderer
+
+    # The new buffers start empty so there's no frame to shift
+    last_view = None
 
     if mode == 0:
-        context = context_gpu
-        queue = queue_gpu
-        program = program_gpu
-        out_np, out_buf = create_out_array_and_buffer(context_gpu, SHAPE, dtype=np.int64)
-        device = device_gpu
+        context, queue, device = get_cl_device(use_gpu=True)
+        program = get_program(True, KERNEL_FILENAMES[mode], get_kernel_options())
         scalar_arg_types = SCALAR_ARG_TYPES_GPU
         device_using = 0
-    else:
-        context = context_cpu
-        queue = queue_cpu
-        program = program_cpu
-        out_np, out_buf = create_out_array_and_buffer(context_cpu, SHAPE, dtype=np.int64)
-        device = device_cpu
+    elif mode == 1:
+        context, queue, device = get_cl_device(use_gpu=False)
+        program = get_program(False, KERNEL_FILENAMES[mode], get_kernel_options())
         scalar_arg_types = SCALAR_ARG_TYPES_CPU
         device_using = 1
+    elif mode == 3:
+        # Float-float on the same device as float, for devices without fast doubles
+        context, queue, device = get_cl_device(use_gpu=True)
+        program = get_program(True, KERNEL_FILENAMES[mode], get_kernel_options())
+        scalar_arg_types = SCALAR_ARG_TYPES_FLOAT_FLOAT
+        device_using = 3
+    else:
+        # Deep zoom, perturbation against a reference orbit on the cpu
+        context, queue, device = get_cl_device(use_gpu=False)
+        program = get_program(False, KERNEL_FILENAMES[mode], get_kernel_options())
+        scalar_arg_types = SCALAR_ARG_TYPES_PERTURBATION
+        device_using = 2
+
+    colour_program = get_program(mode in (0, 3), "CL/kernel_colour.c", create_build_options(out_dtype=get_output_dtype()))
+    create_frame_buffers()
+
+    if MULTI_DEVICE:
+        multi_renderer = get_multi_renderer(KERNEL_FILENAMES[mode], get_kernel_options(), mode in (1, 2))
+
+
+# The cheapest mode precise enough at scale, float-float and perturbation only iterate z^2
+def get_mode_for_scale(scale):
+    if scale >= FLOAT_CUTOFF:
+        return 0
+    if scale >= FLOAT_FLOAT_CUTOFF and USE_FLOAT_FLOAT and Z_POWER == 2:
+        return 3
+    if scale >= DEEP_ZOOM_CUTOFF or Z_POWER != 2:
+        return 1
+    return 2
+
+
+# Pick the device for the current scale when it crosses a precision cutoff
+def update_device_for_scale(old_scale):
+    mode = get_mode_for_scale(XSCALE)
+    if mode != get_mode_for_scale(old_scale):
+        set_device(mode)
 
 def get_scalar_args(do_capture=False):
-    global device_using
+    global device_using, series_skip
+
+    if device_using == 2:
+        set_decimal_precision(XSCALE)
+        orbit = compute_reference_orbit(XOFFSET, YOFFSET, DEPTH, CUTOFF)
+
+        # Skip the early iterations where the whole view still moves together
+        series = None
+        if USE_SERIES_APPROXIMATION:
+            probes = get_series_probes(XMAX, XMIN, YMAX, YMIN, XSCALE, YSCALE)
+            radius = max(abs(probe) for probe in probes)
+            skip, coefficients = compute_series_approximation(orbit, radius, probes, SERIES_TOLERANCE, CUTOFF)
+            series = skip, radius, coefficients
+        series_skip = series[0] if series else 0
+
+        return get_perturbation_args(create_orbit_buffer(context, orbit), orbit,
+                                     XMAX, XMIN, YMAX, YMIN,
+                                     [WIDTH, CAPTURE_WIDTH][do_capture], [HEIGHT, CAPTURE_HEIGHT][do_capture],
+                                     XSCALE, YSCALE, DEPTH, CUTOFF, series)
+
+    if device_using == 3:
+        return (np.float32(XMAX),
+                np.float32(XMIN),
+                np.float32(YMAX),
+                np.float32(YMIN),
+                np.int32([WIDTH, CAPTURE_WIDTH][do_capture]),
+                np.int32([HEIGHT, CAPTURE_HEIGHT][do_capture]),
+                split_float_float(XOFFSET),
+                split_float_float(YOFFSET),
+                split_float_float(XSCALE),
+                split_float_float(YSCALE),
+                np.int32(DEPTH),
+                np.float32(Z_POWER),
+                np.float32(CUTOFF))
+
     floattype = [np.float32, np.double][device_using]
 
     scalar_args = (floattype(XMAX),
@@ -113,8 +279,8 @@ def get_scalar_args(do_capture=False):
                    floattype(YMIN),
                    np.int32([WIDTH, CAPTURE_WIDTH][do_capture]),
                    np.int32([HEIGHT, CAPTURE_HEIGHT][do_capture]),
-                   floattype(XOFFSET),
-                   floattype(YOFFSET),
+                   floattype(float(XOFFSET)),
+                   floattype(float(YOFFSET)),
                    floattype(XSCALE),
                    floattype(YSCALE),
                    np.int32(DEPTH),
@@ -123,6 +289,190 @@ def get_scalar_args(do_capture=False):
     return scalar_args
 
 
+# get_scalar_args for each of the multi-device renderer's contexts, scalar_args are the current context's
+# Only perturbation's differ, by the orbit buffer made again in each context from the (cached) orbit of the view
+def get_device_scalar_args(scalar_args, contexts):
+    if device_using != 2:
+        return [scalar_args] * len(contexts)
+
+    orbit = compute_reference_orbit(XOFFSET, YOFFSET, DEPTH, CUTOFF)
+    return [(create_orbit_buffer(device_context, orbit),) + tuple(scalar_args[1:]) for device_context in contexts]
+
+
+# Size of a display pixel in the complex plane
+def get_pixel_size():
+    return (XMAX - XMIN) * XSCALE / WIDTH, (YMAX - YMIN) * YSCALE / HEIGHT
+
+
+# Pan by multiples of SCALE / PAN_STEP_DIVIDER, snapped to whole pixels so the last frame can be shifted
+def pan_view(x_amount, y_amount):
+    global XOFFSET, YOFFSET
+
+    x_pixel, y_pixel = get_pixel_size()
+    XOFFSET += Decimal(x_pixel) * round(x_amount * XSCALE / PAN_STEP_DIVIDER / x_pixel)
+    YOFFSET += Decimal(y_pixel) * round(y_amount * YSCALE / PAN_STEP_DIVIDER / y_pixel)
+
+
+# Everything about the view except the offsets, the last frame can only be reused if this is unchanged
+# The render modes are included so switching them renders the view again in the new mode
+def get_view_key():
+    return XSCALE, YSCALE, DEPTH, Z_POWER, CUTOFF, out_np.shape, out_np.dtype, device_using, INTERIOR_CHECK, SUBDIVIDE, PROGRESSIVE
+
+
+# Whole pixel shift from the last completed render to the current view, None if it can't be reused
+def get_pixel_shift():
+    if last_view is None or last_view[2:] != get_view_key():
+        return None
+
+    x_pixel, y_pixel = get_pixel_size()
+    dx = (XOFFSET - last_view[0]) / Decimal(x_pixel)
+    dy = (YOFFSET - last_view[1]) / Decimal(y_pixel)
+    if abs(dx - round(dx)) > 1e-6 or abs(dy - round(dy)) > 1e-6 or abs(dx) >= WIDTH or abs(dy) >= HEIGHT:
+        return None
+
+    return int(round(dx)), int(round(dy))
+
+
+# Move the offsets by under a pixel so the view's pixels lie on the global pixel grid for its scale
+def snap_offsets_to_pixels():
+    global XOFFSET, YOFFSET
+
+    x_pixel, y_pixel = get_pixel_size()
+    x_origin = Decimal(XSCALE * XMIN) + XOFFSET
+    y_origin = Decimal(YSCALE * YMIN) + YOFFSET
+    XOFFSET -= x_origin - Decimal(x_pixel) * round(x_origin / Decimal(x_pixel))
+    YOFFSET -= y_origin - Decimal(y_pixel) * round(y_origin / Decimal(y_pixel))
+
+
+# Global pixel grid position of the view's top left pixel, once snapped
+def get_grid_origin():
+    x_pixel, y_pixel = get_pixel_size()
+    x_origin = Decimal(XSCALE * XMIN) + XOFFSET
+    y_origin = Decimal(YSCALE * YMIN) + YOFFSET
+    return int(round(x_origin / Decimal(x_pixel))), int(round(y_origin / Decimal(y_pixel)))
+
+
+# Tiles are shared between views with the same pixel size and kernel, whatever the depth
+def get_tile_view_key():
+    x_pixel, y_pixel = get_pixel_size()
+    return f"{x_pixel:.12g}", f"{y_pixel:.12g}", Z_POWER, CUTOFF, out_np.dtype.str, device_using, INTERIOR_CHECK
+
+
+# Work-group shape of each program, tuned on its first full frame if its device and kernel variant haven't been yet
+program_launches = {}
+
+def get_frame_launch(queue, program, kernel_filename, options, out_np, out_buf, scalar_args, scalar_arg_types):
+    if program not in program_launches:
+        program_launches[program] = DEFAULT_LAUNCH
+        if AUTOTUNE_LAUNCH:
+            program_launches[program] = get_launch(queue, program, kernel_filename, options, out_np, out_buf, scalar_args,
+                                                   scalar_arg_types)
+    return program_launches[program]
+
+
+# The device, program and modes a render uses, for render_frame and render_view
+# Taken when the render is submitted, so an async render can't pair buffers from before a device switch or mode
+# toggle with the program and queue from after it, or the view it was submitted for with a newer one
+def get_render_setup(scalar_args):
+    return dict(queue=queue, program=program, scalar_arg_types=scalar_arg_types, kernel_filename=KERNEL_FILENAMES[device_using],
+                options=get_kernel_options(), subdivide=SUBDIVIDE, multi_renderer=multi_renderer if MULTI_DEVICE else None,
+                device_scalar_args=get_device_scalar_args(scalar_args, multi_renderer.contexts) if MULTI_DEVICE else None,
+                colour_on_device=COLOUR_ON_DEVICE, colour_program=colour_program, palette_buf=palette_buf)
+
+
+# Counts at an (n, 2) array of pixel positions, split across the devices when there's a multi-device renderer
+def calculate_points(points, scalar_args, queue, program, scalar_arg_types, dtype, multi_renderer=None, device_scalar_args=None):
+    if multi_renderer is not None:
+        return multi_renderer.render_points(points, device_scalar_args, scalar_arg_types, dtype)
+    return calculate_points_opencl(queue, program, points, scalar_args, scalar_arg_types, dtype)
+
+
+# Render the view into out_np, returns the number of pixels computed
+def render_view(out_np, out_buf, scalar_args, queue, program, scalar_arg_types, kernel_filename, options, subdivide,
+                multi_renderer, device_scalar_args):
+    if subdivide:
+        # Mariani-Silver, only rectangle borders go through the kernel until they differ
+        evaluate = lambda xs, ys: calculate_points(np.stack((xs, ys), axis=1), scalar_args, queue, program, scalar_arg_types,
+                                                   out_np.dtype, multi_renderer, device_scalar_args)
+        out_np[:], pixels_computed = mariani_silver(evaluate, out_np.shape, out_np.dtype)
+        return pixels_computed
+
+    if multi_renderer is not None:
+        multi_renderer.render(out_np, device_scalar_args, scalar_arg_types)
+        return out_np.size
+
+    calculate_mandelbrot_opencl(queue, program, out_np, out_buf, scalar_args, scalar_arg_types,
+                                launch=get_frame_launch(queue, program, kernel_filename, options, out_np, out_buf, scalar_args,
+                                                        scalar_arg_types))
+    return out_np.size
+
+
+# Render the view into the given buffers, or colour it into rgba_np on the device, returns the number of pixels computed
+# The rest of the arguments are a get_render_setup()
+def render_frame(out_np, out_buf, rgba_np, rgba_buf, scalar_args, queue, program, scalar_arg_types, kernel_filename, options,
+                 subdivide, multi_renderer, device_scalar_args, colour_on_device, colour_program, palette_buf):
+    if colour_on_device:
+        # Counts stay on the device, only the coloured frame comes back
+        calculate_mandelbrot_opencl(queue, program, out_np, out_buf, scalar_args, scalar_arg_types, do_copy=False,
+                                    launch=get_frame_launch(queue, program, kernel_filename, options, out_np, out_buf,
+                                                            scalar_args, scalar_arg_types))
+        colour_mandelbrot_opencl(queue, colour_program, rgba_np, rgba_buf, out_buf, palette_buf, 256, PALETTE_SCALE)
+        return out_np.size
+
+    return render_view(out_np, out_buf, scalar_args, queue, program, scalar_arg_types, kernel_filename, options, subdivide,
+                       multi_renderer, device_scalar_args)
+
+
+# Compute one progressive pass into out_np, reusing the pixels of coarser passes, returns the number of pixels computed
+# prev_np holds the coarser passes when they aren't already in out_np, as when passes alternate between buffers
+# With a multi_renderer the pass's points are split across its devices, see get_device_scalar_args
+def refine_view(out_np, scalar_args, level, queue, program, scalar_arg_types, multi_renderer=None, device_scalar_args=None,
+                prev_np=None):
+    step = PROGRESSIVE_STEPS[level]
+    prev_step = PROGRESSIVE_STEPS[level - 1] if level else None
+
+    if prev_np is not None:
+        out_np[:] = prev_np
+
+    xs, ys = refinement_points(out_np.shape, step, prev_step)
+    points = np.stack((xs, ys), axis=1)
+    out_np[xs, ys] = calculate_points(points, scalar_args, queue, program, scalar_arg_types, out_np.dtype, multi_renderer,
+                                      device_scalar_args)
+
+    if step > 1:
+        fill_blocks(out_np, step)
+
+    return xs.size
+
+
+# Render a capture band by band straight to disk so memory doesn't grow with CAPTURE_SHAPE
+# Png captures are anti-aliased by supersampling just the pixels on boundaries, the rest are rendered once
+def save_capture(filename):
+    capture_args = get_scalar_args(do_capture=True)
+    supersample = CAPTURE_FORMAT != 'raw' and CAPTURE_SUPERSAMPLE > 1
+
+    # Supersampled bands have a row either side to find the boundaries along their edges
+    overlap = 1 if supersample else 0
+    band, band_buf = buffer_pool.get(context, (CAPTURE_WIDTH, CAPTURE_BAND_HEIGHT + 2 * overlap), dtype=get_output_dtype())
+
+    render_band = lambda y_start, band: calculate_region_opencl(queue, program, band, band_buf, (0, y_start),
+                                                                capture_args, scalar_arg_types)
+    bands = capture_bands(CAPTURE_HEIGHT, band, render_band, overlap)
+
+    if CAPTURE_FORMAT == 'raw':
+        # Always uint32 counts whatever the kernels write, fractional smooth counts are truncated
+        write_raw(f"{filename}.raw", CAPTURE_SHAPE, bands, np.uint32)
+    elif supersample:
+        evaluate = lambda xs, ys: calculate_points_opencl(queue, program, np.stack((xs, ys), axis=1), capture_args,
+                                                          scalar_arg_types, get_output_dtype())
+        write_png_rgb(f"{filename}.png", CAPTURE_SHAPE, supersample_bands(bands, evaluate, get_surface_palette(),
+                                                                          CAPTURE_SUPERSAMPLE))
+    else:
+        write_png(f"{filename}.png", CAPTURE_SHAPE, bands, get_surface_palette())
+
+    buffer_pool.put(band, band_buf)
+
+
 def draw_text(surface, text, font, pos, color):
     i = 0
     for textline in text.splitlines():
@@ -136,6 +486,13 @@ def draw_text(surface, text, font, pos, color):
     return()
 
 
+if PROFILE:
+    set_event_callback(record_event)
+    if PROFILE_LOG:
+        open_profile_log(PROFILE_LOG)
+
+async_renderer = AsyncRenderer()
+
 set_device(0)
 
 pygame.init()
@@ -169,33 +526,153 @@ step = 0
 do_save = False
 do_update = True
 do_display_text = True
+do_display_profile = False
 last_time_taken = 0
+last_pixels_computed = 0
+last_first_pass_time = 0
+refine_level = None
+refine_args = None
+refine_multi_renderer = None
+refine_device_args = None
+last_view = None
+force_render = False
+render_pending = False
+frame_changed = True
+out_surface = None
 
 running = True
 while running:
+    # Keep enough decimal digits for pans at the current zoom
+    set_decimal_precision(XSCALE)
 
-    # Only recalculate when view is changed
+    # Only recalculate when view is changed, this restarts any refinement still in progress
     if do_update:
-        # Get the arguments in numpy format
-        scalar_args = get_scalar_args()
-
         # Time it
         start_time = time.time()
-        calculate_mandelbrot_opencl(queue, program, out_np, out_buf, scalar_args, scalar_arg_types)
-        last_time_taken = round(time.time() - start_time, 3)
+        render_start_time = time.perf_counter()
+
+        # The new view replaces whatever is still rendering
+        if render_pending:
+            async_renderer.cancel()
+            render_pending = False
+
+        if USE_TILE_CACHE and not COLOUR_ON_DEVICE:
+            snap_offsets_to_pixels()
+            grid_origin, tile_key = get_grid_origin(), get_tile_view_key()
+            tiles_cached = count_cached_tiles(tile_cache, out_np.shape, grid_origin, tile_key, DEPTH)
+            tiles_needed = len(tiles_for_view(out_np.shape, grid_origin))
+
+        refine_args = get_scalar_args()
+        pixel_shift = get_pixel_shift()
+
+        if pixel_shift is not None:
+            # Pure pan, shift the last frame and only compute the exposed strips
+            # Tried before the tile cache, which would compute whole tiles along the strips
+            refine_level = None
+            xs, ys = shift_frame(out_np, *pixel_shift)
+            points = np.stack((xs, ys), axis=1)
+            out_np[xs, ys] = calculate_points_opencl(queue, program, points, refine_args, scalar_arg_types, out_np.dtype)
+            last_pixels_computed = xs.size
+            last_time_taken = last_first_pass_time = round(time.time() - start_time, 3)
+        elif USE_TILE_CACHE and not COLOUR_ON_DEVICE and not force_render and tiles_cached * 2 >= tiles_needed:
+            # Mostly seen before, take what's cached and compute the rest as whole tiles
+            refine_level = None
+            evaluate = lambda xs, ys: calculate_points_opencl(queue, program, np.stack((xs, ys), axis=1), refine_args, scalar_arg_types,
+                                                              out_np.dtype)
+            last_pixels_computed = render_tiles(tile_cache, evaluate, out_np, grid_origin, tile_key, DEPTH)
+            last_time_taken = last_first_pass_time = round(time.time() - start_time, 3)
+        elif PROGRESSIVE and not SUBDIVIDE and not COLOUR_ON_DEVICE:
+            refine_level = 0
+            last_pixels_computed = 0
+            # Every pass is split across the devices with the same arguments
+            refine_multi_renderer = multi_renderer if MULTI_DEVICE else None
+            refine_device_args = get_device_scalar_args(refine_args, multi_renderer.contexts) if MULTI_DEVICE else None
+        elif ASYNC_RENDER:
+            # Picked up below once the worker is done
+            refine_level = None
+            render_pending = True
+            async_renderer.submit(partial(render_frame, back_np, back_buf, back_rgba_np, back_rgba_buf, refine_args,
+                                          **get_render_setup(refine_args)))
+        else:
+            refine_level = None
+            last_pixels_computed = render_frame(out_np, out_buf, rgba_np, rgba_buf, refine_args, **get_render_setup(refine_args))
+            last_time_taken = last_first_pass_time = round(time.time() - start_time, 3)
+
+        # Async renders and progressive passes are timed once the frame is complete
+        if not render_pending and refine_level is None:
+            record_time("render", time.perf_counter() - render_start_time)
 
         # Don't redraw
         do_update = False
+        force_render = False
+        frame_changed = True
+
+        # A frame can be shifted and cached once it is complete, out_np isn't filled when colouring on the device
+        # While an async render is pending out_np still holds the last frame, which can still be shifted
+        view = (XOFFSET, YOFFSET) + get_view_key()
+        if refine_level is not None or COLOUR_ON_DEVICE:
+            last_view = None
+        elif not render_pending:
+            last_view = view
+            if USE_TILE_CACHE:
+                cache_frame(tile_cache, out_np, grid_origin, tile_key, DEPTH)
+
+    # Swap in the async render once it's finished
+    pass_pixels = None
+    if render_pending:
+        result = async_renderer.poll()
+        if result is not None:
+            _, pixels_computed = result
+            render_pending = False
+            swap_frame_buffers()
+            frame_changed = True
+
+            if refine_level is not None:
+                # A progressive pass, the next is started below
+                pass_pixels = pixels_computed
+            else:
+                last_pixels_computed = pixels_computed
+                last_time_taken = last_first_pass_time = round(time.time() - start_time, 3)
+                record_time("render", time.perf_counter() - render_start_time)
+
+                if not COLOUR_ON_DEVICE:
+                    last_view = view
+                    if USE_TILE_CACHE:
+                        cache_frame(tile_cache, out_np, grid_origin, tile_key, DEPTH)
+
+    # One refinement pass per frame so events are still handled between passes
+    if refine_level is not None and not ASYNC_RENDER:
+        with stage("refine"):
+            pass_pixels = refine_view(out_np, refine_args, refine_level, queue, program, scalar_arg_types, refine_multi_renderer,
+                                      refine_device_args)
+        frame_changed = True
+
+    if pass_pixels is not None:
+        last_pixels_computed += pass_pixels
+        if refine_level == 0:
+            last_first_pass_time = round(time.time() - start_time, 3)
+
+        refine_level += 1
+        if refine_level == len(PROGRESSIVE_STEPS):
+            refine_level = None
+            last_time_taken = round(time.time() - start_time, 3)
+            record_time("render", time.perf_counter() - render_start_time)
+            last_view = view
+            if USE_TILE_CACHE:
+                cache_frame(tile_cache, out_np, grid_origin, tile_key, DEPTH)
+
+    # Async passes go to the worker one at a time, each rendering into the back buffers from the pass on display
+    if refine_level is not None and ASYNC_RENDER and not render_pending:
+        render_pending = True
+        async_renderer.submit(partial(refine_view, back_np, refine_args, refine_level, queue, program, scalar_arg_types,
+                                      refine_multi_renderer, refine_device_args, out_np if refine_level else None))
 
     step = (step + 1)
 
     # Save a high res version
     if do_save:
-        capture_out_np, capture_out_buf = create_out_array_and_buffer(context, CAPTURE_SHAPE, dtype=np.int64)
-        scalar_args = get_scalar_args(do_capture=True)
-        calculate_mandelbrot_opencl(queue, program, capture_out_np, capture_out_buf, scalar_args, scalar_arg_types)
-        capture_surface = pygame.surfarray.make_surface(capture_out_np)
-        pygame.image.save(capture_surface, f"capture/Mandelbrot {pos_text}.png")
+        with stage("capture"):
+            save_capture(f"capture/Mandelbrot {pos_text}")
         do_save = False
 
     # Pygame events loop
@@ -208,8 +685,8 @@ while running:
             SHAPE = WIDTH, HEIGHT = event.size
             print(f"Resizing to {SHAPE}")
 
-            # Need new buffer for new size
-            out_np, out_buf = create_out_array_and_buffer(context, SHAPE, dtype=np.int64)
+            # Need new buffers for new size
+            create_frame_buffers()
 
             # Decide how to set the display
             screen_width, screen_height = screen_res = SHAPE
@@ -228,34 +705,62 @@ while running:
                 running = False
             elif event.key == K_SPACE:
                 do_save = True
+            elif event.key == K_i:
+                # Toggle the interior early-out to compare against the full iteration
+                INTERIOR_CHECK = not INTERIOR_CHECK
+                set_device(device_using)
+                do_update = True
+            elif event.key == K_m:
+                # Cached tiles would hide the switch, so the whole view is rendered again
+                SUBDIVIDE = not SUBDIVIDE
+                force_render = True
+                do_update = True
+            elif event.key == K_r:
+                PROGRESSIVE = not PROGRESSIVE
+                force_render = True
+                do_update = True
+            elif event.key == K_c:
+                USE_TILE_CACHE = not USE_TILE_CACHE
+                do_update = True
+            elif event.key == K_p:
+                do_display_profile = not do_display_profile
+            elif event.key == K_o:
+                # The count type changes with smooth colouring so the programs are picked again
+                COLOUR_ON_DEVICE = not COLOUR_ON_DEVICE
+                set_device(device_using)
+                do_update = True
 
             if event.key == K_UP:
-                YOFFSET -= YSCALE / PAN_STEP_DIVIDER
+                pan_view(0, -1)
                 do_update = True
             elif event.key == K_DOWN:
-                YOFFSET += YSCALE / PAN_STEP_DIVIDER
+                pan_view(0, 1)
                 do_update = True
             elif event.key == K_LEFT:
-                XOFFSET -= XSCALE / PAN_STEP_DIVIDER
+                pan_view(-1, 0)
                 do_update = True
             elif event.key == K_RIGHT:
-                XOFFSET += XSCALE / PAN_STEP_DIVIDER
+                pan_view(1, 0)
                 do_update = True
 
         elif event.type == MOUSEMOTION:
             if USE_MOUSE:
                 mousex, mousey = pygame.mouse.get_pos()
-                XOFFSET = (XMAX - XMIN) * (mousex / screen_width) + XMIN;
-                YOFFSET = (YMAX - YMIN) * (mousey / screen_height) + YMIN;
+                XOFFSET = Decimal((XMAX - XMIN) * (mousex / screen_width) + XMIN)
+                YOFFSET = Decimal((YMAX - YMIN) * (mousey / screen_height) + YMIN)
                 do_update = True
         elif event.type == MOUSEBUTTONDOWN:
             if event.button == 4:
+                old_scale = XSCALE
                 XSCALE /= ZOOM_FACTOR
                 YSCALE /= ZOOM_FACTOR
+                update_device_for_scale(old_scale)
                 do_update = True
             elif event.button == 5:
+                old_scale = XSCALE
                 XSCALE *= ZOOM_FACTOR
                 YSCALE *= ZOOM_FACTOR
+                update_device_for_scale(old_scale)
                 do_update = True
             elif event.button == 2:
                 USE_MOUSE = not USE_MOUSE
@@ -268,7 +773,7 @@ while running:
                 set_device(0)
                 do_update = True
             elif event.button == 9:
-                set_device(not device_using)
+                set_device(int(not device_using))
                 do_update = True
             elif event.button == 6:
                 running = False
@@ -289,8 +794,7 @@ while running:
 
         elif event.type == JOYHATMOTION:
             x_pan, y_pan = event.value
-            XOFFSET += x_pan * XSCALE / PAN_STEP_DIVIDER
-            YOFFSET -= y_pan * YSCALE / PAN_STEP_DIVIDER
+            pan_view(x_pan, -y_pan)
             do_update = True
 
     # Receive any movement from the joystick
@@ -304,43 +808,66 @@ while running:
             YSCALE *= 1 + (zoom_amount) / 8
             do_update = True
 
-            if XSCALE < FLOAT_CUTOFF and old_scale > FLOAT_CUTOFF:
-                set_device(1)
-            elif XSCALE > FLOAT_CUTOFF and old_scale < FLOAT_CUTOFF:
-                set_device(0)
+            update_device_for_scale(old_scale)
 
         xmove_amount = round(joystick.get_axis(0), 16)
         if xmove_amount > 0.2 or xmove_amount < -0.2:
-            XOFFSET += xmove_amount * XSCALE / PAN_STEP_DIVIDER
+            pan_view(xmove_amount, 0)
             do_update = True
 
         ymove_amount = round(joystick.get_axis(1), 16)
         if ymove_amount > 0.2 or ymove_amount < -0.2:
-            YOFFSET += ymove_amount * YSCALE / PAN_STEP_DIVIDER
+            pan_view(0, ymove_amount)
             do_update = True
 
         depth_change = round(joystick.get_axis(4), 4)
         if depth_change > 0.2 or depth_change < -0.2:
             DEPTH += round(depth_change)
+            if SPECIALISE_DEPTH:
+                set_device(device_using)
             do_update = True
 
     # Drawing to screen
     surface.fill(GREY)
-    out_surface = pygame.surfarray.make_surface(out_np)
-    out_surface_scale = pygame.transform.scale(out_surface, screen_res)
-    surface.blit(out_surface_scale, (0, 0))
+    # Only rebuild the surface when the frame has changed
+    if frame_changed:
+        with stage("make_surface"):
+            if COLOUR_ON_DEVICE:
+                out_surface = pygame.image.frombuffer(rgba_np, (WIDTH, HEIGHT), 'RGBA')
+            else:
+                out_surface = pygame.surfarray.make_surface(out_np)
+        frame_changed = False
+    with stage("scale"):
+        out_surface_scale = pygame.transform.scale(out_surface, screen_res)
+    with stage("blit"):
+        surface.blit(out_surface_scale, (0, 0))
 
     if do_display_text:
         save_text = ["", "[Saving...]"][do_save]
-        render_text = ["", "[Rendering...]"][do_update]
+        render_text = ["", "[Rendering...]"][do_update or render_pending]
+        if refine_level is not None:
+            render_text += f"[Refining 1/{PROGRESSIVE_STEPS[refine_level]}...]"
         pos_text = f"x {round(XOFFSET, 5)}, y {round(YOFFSET, 5)}, zoom {round(1 / XSCALE)}"
-        text_to_draw = f"""{save_text}{render_text}Rendering on {device.name}
-Rendered in {last_time_taken}s
+        text_to_draw = f"""{save_text}{render_text}Rendering on {device.name} in {["float", "double", "perturbation", "float-float"][device_using]}
+Rendered in {last_time_taken}s, first pass in {last_first_pass_time}s, computed {round(100 * last_pixels_computed / out_np.size)}% of pixels
 {pos_text}
-Depth {DEPTH}"""
-        draw_text(surface, text_to_draw, font, (128, 64), GREEN)
-
-    pygame.display.update()
+Depth {DEPTH}{["", " [Interior check]"][INTERIOR_CHECK]}"""
+        if device_using == 2:
+            text_to_draw += f"\nSeries skipped {series_skip} iterations"
+        if MULTI_DEVICE:
+            text_to_draw += f"\nSplit over {len(multi_renderer.devices)} devices, pixels {multi_renderer.last_pixels}"
+        if do_display_profile:
+            # Slowest stages first, mean and max over the last few measurements
+            for name, (last, mean, maximum) in sorted(get_stage_stats().items(), key=lambda item: -item[1][1]):
+                text_to_draw += f"\n{name} {mean * 1000:.2f}ms, max {maximum * 1000:.2f}ms"
+        with stage("text"):
+            draw_text(surface, text_to_draw, font, (128, 64), GREEN)
+
+    with stage("display_update"):
+        pygame.display.update()
+    end_frame()
     fps_clock.tick(60)
 
+async_renderer.close()
+close_profile_log()
 pygame.quit()
\ No newline at end of file
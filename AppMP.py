@@ -1,10 +1,21 @@
 from MP.mandelbrot_func import *
+from MP.framebuffer import create_framebuffer
 
 
 if __name__ == '__main__':
+    import argparse
+
     from pygame.locals import *
     import pygame.freetype
 
+    parser = argparse.ArgumentParser(description="Mandelbrot renderer using a multiprocessing pool")
+    parser.add_argument('--num-proc', type=int, default=None, help="worker processes (default: one per cpu)")
+    parser.add_argument('--chunk-size', type=int, default=1, help="tiles handed to a worker at a time")
+    parser.add_argument('--tile-size', type=int, default=64, help="width and height of each tile in pixels")
+    parser.add_argument('--no-interior-check', action='store_true', help="disable the cardioid/bulb and periodicity early-outs")
+    parser.add_argument('--subdivide', action='store_true', help="Mariani-Silver subdivision within each tile")
+    args = parser.parse_args()
+
     BLACK = pygame.Color(0, 0, 0)
     WHITE = pygame.Color(255, 255, 255)
     GREY = pygame.Color(145, 145, 145)
@@ -18,6 +29,11 @@ if __name__ == '__main__':
         text_rect.topleft = text_pos
         surface.blit(text_surface, text_rect)
 
+    # Expand iteration counts to grey RGB only when displaying
+    def framebuffer_to_rgb(framebuffer):
+        grey = np.where(framebuffer == FRAMEBUFFER_UNSET, 0, framebuffer * 255 // DEPTH).astype(np.uint8)
+        return np.repeat(grey[:, :, np.newaxis], 3, axis=2)
+
     def save_mandelbrot_surface(save_surface):
         asctime = time.asctime().replace(':', '')
         pygame.image.save(save_surface, f"capture/mandelbrot_image {asctime}.png")
@@ -31,18 +47,17 @@ if __name__ == '__main__':
     # Font
     time_font = pygame.freetype.SysFont(TIME_FONT_NAME, TIME_FONT_SIZE, bold=TIME_BOLD)
 
+    # Shared framebuffer the workers write into and the display reads from directly
+    framebuffer_shm, framebuffer = create_framebuffer(SHAPE)
+
     # Create sub process for calculating mandelbrot set
     calc_parent_conn, calc_child_conn = mp.Pipe()
-    progress_value = mp.Value('d', 0.0)
-    p = mp.Process(target=calculate_mandelbrot, args=(calc_child_conn, progress_value))
+    progress_value = mp.Array('d', 3)
+    p = mp.Process(target=calculate_mandelbrot, args=(calc_child_conn, progress_value, framebuffer_shm.name),
+                   kwargs=dict(num_proc=args.num_proc, chunk_size=args.chunk_size, tile_size=args.tile_size,
+                               interior_check=not args.no_interior_check, subdivide=args.subdivide))
     p.start()
 
-    # Ensure mandelbrot file is created
-    calc_parent_conn.recv()
-
-    # Map surface array file
-    surf_array = np.memmap(SURFARRAY_FILENAME, dtype=SURFARRAY_DTYPE, mode='r+', shape=SURFARRAY_SHAPE)
-
     # Initialise variables for main loop
     do_loop = True
     is_saved = False
@@ -56,8 +71,8 @@ if __name__ == '__main__':
         # Fill background
         s.fill(GREY)
 
-        # Draw surf array
-        surf_array_surface = pygame.surfarray.make_surface(surf_array)
+        # Draw framebuffer
+        surf_array_surface = pygame.surfarray.make_surface(framebuffer_to_rgb(framebuffer))
         surf_array_surface_trans = pygame.transform.scale(surf_array_surface, SCREEN_RESOLUTION)
         s.blit(surf_array_surface_trans, (0, 0))
 
@@ -67,7 +82,10 @@ if __name__ == '__main__':
         time_text += ['[Unsaved]', '[Saved]'][is_saved]
         draw_text(s, time_text, time_font, (16, 16), GREEN)
 
-        draw_text(s, f"{progress_value.value}%", time_font, (16, 32), GREEN)
+        progress_text = f"{progress_value[PROGRESS_PERCENT]}% "
+        progress_text += f"{int(progress_value[PROGRESS_RATE])}px/s "
+        progress_text += f"ETA {progress_value[PROGRESS_ETA]}s"
+        draw_text(s, progress_text, time_font, (16, 32), GREEN)
 
         # Pygame events
         for event in pygame.event.get():
@@ -98,4 +116,9 @@ if __name__ == '__main__':
     p.join(timeout=1)
     p.terminate()
 
+    # Release the shared framebuffer
+    del framebuffer
+    framebuffer_shm.close()
+    framebuffer_shm.unlink()
+
     pygame.quit()
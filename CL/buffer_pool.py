@@ -0,0 +1,41 @@
+import numpy as np
+
+from CL.mandelbrot_func import create_out_array_and_buffer
+
+
+# Output arrays and buffers kept for reuse, by context, shape and dtype
+# Handing back the frame buffers on a resize or device switch means going back again (or switching precision
+# back and forth) reuses them instead of allocating a new set each time
+class BufferPool:
+    # max_bytes caps what's kept while not in use, the least recently returned go first
+    def __init__(self, max_bytes=512 * 1024**2):
+        self.max_bytes = max_bytes
+        self._free = []
+        self._free_bytes = 0
+
+    # An (out_np, out_buf) pair like create_out_array_and_buffer's, its contents are whatever was left in it
+    def get(self, context, array_shape, dtype=np.float32):
+        key = context, tuple(array_shape), np.dtype(dtype)
+        for i, (free_key, out_np, out_buf) in enumerate(self._free):
+            if free_key == key:
+                del self._free[i]
+                self._free_bytes -= out_np.nbytes
+                return out_np, out_buf
+
+        return create_out_array_and_buffer(context, array_shape, dtype)
+
+    # Hand back a pair from get once nothing reads or writes it anymore
+    def put(self, out_np, out_buf):
+        self._free.append(((out_buf.context, out_np.shape, out_np.dtype), out_np, out_buf))
+        self._free_bytes += out_np.nbytes
+
+        while self._free_bytes > self.max_bytes:
+            _, old_np, old_buf = self._free.pop(0)
+            self._free_bytes -= old_np.nbytes
+            old_buf.release()
+
+    def clear(self):
+        for _, _, out_buf in self._free:
+            out_buf.release()
+        self._free = []
+        self._free_bytes = 0
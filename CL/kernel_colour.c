@@ -0,0 +1,38 @@
+// Count type written by the znplus1 kernels, built with the same OUT_T
+#ifndef OUT_T
+#define OUT_T long
+#endif
+
+    // Colour a width x height frame of counts with a palette, writing RGBA rows ready for display
+    // Counts are laid out x major like the znplus1 output, the colours row by row like an image
+    // Fractional (SMOOTH) counts blend between neighbouring palette entries, 0 is always palette[0]
+    kernel void colour(
+    global uchar4 *rgba_buf,
+    global const OUT_T *counts,
+    global const uchar4 *palette,
+            int palette_size,
+            float palette_scale,
+            int width,
+            int height)
+    {{
+        int gid = get_global_id(0);
+
+        int x_int = gid/height;
+        int y_int = gid%height;
+
+        float count = counts[gid];
+
+        uchar4 colour = palette[0];
+        if (count > 0)
+        {{
+            float index = count * palette_scale;
+            float index_floor = floor(index);
+            int i = (int)index_floor % palette_size;
+
+            float4 low = convert_float4(palette[i]);
+            float4 high = convert_float4(palette[(i + 1) % palette_size]);
+            colour = convert_uchar4_sat_rte(mix(low, high, index - index_floor));
+        }}
+
+        rgba_buf[y_int*width + x_int] = colour;
+    }}
@@ -3,8 +3,127 @@
 
 #include <pyopencl-complex.h>
 
+// Periodicity tolerance as a fraction of a pixel
+#ifndef PERIOD_TOLERANCE
+#define PERIOD_TOLERANCE 1e-3
+#endif
+
+// Output type, narrower types cut the copy back to the host, float holds SMOOTH fractional counts
+#ifndef OUT_T
+#define OUT_T long
+#endif
+
+// Z_POWER, DEPTH and CUTOFF can be fixed at build time, replacing the z_power, depth and cutoff arguments
+// An integer Z_POWER iterates with plain multiplies instead of cdouble_powr
+
+#ifdef SMOOTH
+typedef float count_t;
+#else
+typedef int count_t;
+#endif
+
+    // z^z_power + c
+    cdouble_t znplus1_step(cdouble_t z, cdouble_t c, double z_power)
+    {{
+#if defined(Z_POWER) && Z_POWER == 2
+        cdouble_t z_next;
+        z_next.real = z.real*z.real - z.imag*z.imag + c.real;
+        z_next.imag = 2*z.real*z.imag + c.imag;
+        return z_next;
+#elif defined(Z_POWER)
+        cdouble_t z_n = z;
+        for (int i = 1; i < Z_POWER; i++)
+        {{
+            z_n = cdouble_mul(z_n, z);
+        }}
+        return cdouble_add(z_n, c);
+#else
+        return cdouble_add(cdouble_powr(z, z_power), c);
+#endif
+    }}
+
+    // Iterations left when c = x + yi escapes past |z| > cutoff, 0 if it never does
+    // With SMOOTH the fraction of the last iteration is included from how far past cutoff z got
+    count_t znplus1_count(double x, double y, int depth, double z_power, double cutoff, double pixel_size)
+    {{
+#ifdef Z_POWER
+        z_power = Z_POWER;
+#endif
+#ifdef DEPTH
+        depth = DEPTH;
+#endif
+#ifdef CUTOFF
+        cutoff = CUTOFF;
+#endif
+        double cutoff_sq = cutoff * cutoff;
+
+        cdouble_t c;
+        c.real = x;
+        c.imag = y;
+
+        cdouble_t z;
+        z.real = 0;
+        z.imag = 0;
+
+        int count = depth;
+
+#ifdef INTERIOR_CHECK
+        // Points in the main cardioid or the period 2 bulb never escape
+        if (z_power == 2)
+        {{
+            double xq = x - 0.25;
+            double q = xq*xq + y*y;
+            if (q*(q + xq) <= 0.25*y*y || (x + 1)*(x + 1) + y*y <= 0.0625)
+            {{
+                count = 0;
+            }}
+        }}
+
+        // Brent's periodicity check, z is compared to a saved value which is replaced at doubling intervals
+        double period_tolerance = PERIOD_TOLERANCE * pixel_size;
+        cdouble_t z_saved = z;
+        int period_check = 1;
+        int period_steps = 0;
+#endif
+
+        for (; count > 0; count--)
+        {{
+            z = znplus1_step(z, c, z_power);
+            if (z.real*z.real + z.imag*z.imag > cutoff_sq)
+            {{
+                break;
+            }}
+
+#ifdef INTERIOR_CHECK
+            if (fabs(z.real - z_saved.real) < period_tolerance && fabs(z.imag - z_saved.imag) < period_tolerance)
+            {{
+                count = 0;
+                break;
+            }}
+            if (++period_steps == period_check)
+            {{
+                period_steps = 0;
+                period_check *= 2;
+                z_saved = z;
+            }}
+#endif
+        }}
+
+#ifdef SMOOTH
+        if (count > 0)
+        {{
+            return count - 1 + clamp(log2(log(cdouble_abs(z)) / log(cutoff)), 0.0, 1.0);
+        }}
+#endif
+
+        return count;
+    }}
+
+    // 2D launch, dimension 0 runs down a column of the frame so neighbouring work items write neighbouring counts
+    // Each work item does pixels_per_item pixels along its row
     kernel void znplus1(
-    global long *out_buf,
+    global OUT_T *out_buf,
+            int pixels_per_item,
             double xmax,
             double xmin,
             double ymax,
@@ -19,34 +138,86 @@
             double z_power,
             double cutoff)
     {{
-        int gid = get_global_id(0);
-
-        int x_int = (gid + 1)/height;
-        int y_int = (gid + 1)%height;
+        // The global size is padded up to a multiple of the work-group shape
+        int y_int = get_global_id(0);
+        if (y_int >= height)
+        {{
+            return;
+        }}
 
-        double x_unscaled = (xmax - xmin)*(x_int/(double)width) + xmin;
         double y_unscaled = (ymax - ymin)*(y_int/(double)height) + ymin;
+        double y = yscale * y_unscaled + yoffset;
+
+        int x_end = min(width, ((int)get_global_id(1) + 1)*pixels_per_item);
+        for (int x_int = get_global_id(1)*pixels_per_item; x_int < x_end; x_int++)
+        {{
+            double x_unscaled = (xmax - xmin)*(x_int/(double)width) + xmin;
+            double x = xscale * x_unscaled + xoffset;
+
+            out_buf[x_int*height + y_int] = znplus1_count(x, y, depth, z_power, cutoff, xscale*(xmax - xmin)/width);
+        }}
+    }}
+
+    // Same as znplus1 for a list of (possibly fractional) pixel positions
+    kernel void znplus1_points(
+    global OUT_T *out_buf,
+    global const float2 *points,
+            double xmax,
+            double xmin,
+            double ymax,
+            double ymin,
+            int width,
+            int height,
+            double xoffset,
+            double yoffset,
+            double xscale,
+            double yscale,
+            int depth,
+            double z_power,
+            double cutoff)
+    {{
+        int gid = get_global_id(0);
+        float2 point = points[gid];
+
+        double x_unscaled = (xmax - xmin)*(point.x/(double)width) + xmin;
+        double y_unscaled = (ymax - ymin)*(point.y/(double)height) + ymin;
 
         double x = xscale * x_unscaled + xoffset;
         double y = yscale * y_unscaled + yoffset;
 
-        cdouble_t c;
-        c.real = x;
-        c.imag = y;
+        out_buf[gid] = znplus1_count(x, y, depth, z_power, cutoff, xscale*(xmax - xmin)/width);
+    }}
 
-        cdouble_t z;
-        z.real = 0;
-        z.imag = 0;
+    // Same as znplus1 for the part of the frame starting at x_start, y_start, out_buf is region_height pixels high
+    kernel void znplus1_region(
+    global OUT_T *out_buf,
+            int x_start,
+            int y_start,
+            int region_height,
+            double xmax,
+            double xmin,
+            double ymax,
+            double ymin,
+            int width,
+            int height,
+            double xoffset,
+            double yoffset,
+            double xscale,
+            double yscale,
+            int depth,
+            double z_power,
+            double cutoff)
+    {{
+        int gid = get_global_id(0);
 
-        int count = 0;
-        for (count = depth; count > 0; count--)
-        {{
-            z = cdouble_add(cdouble_powr(z, z_power), c);
-            if (z.real > cutoff)
-            {{
-                break;
-            }}
-        }}
+        int x_int = x_start + gid/region_height;
+        int y_int = y_start + gid%region_height;
+
+        double x_unscaled = (xmax - xmin)*(x_int/(double)width) + xmin;
+        double y_unscaled = (ymax - ymin)*(y_int/(double)height) + ymin;
+
+        double x = xscale * x_unscaled + xoffset;
+        double y = yscale * y_unscaled + yoffset;
 
-        out_buf[gid] = count;
-    }}
\ No newline at end of file
+        out_buf[gid] = znplus1_count(x, y, depth, z_power, cutoff, xscale*(xmax - xmin)/width);
+    }}
@@ -0,0 +1,255 @@
+// Float-float kernel, each coordinate is an unevaluated sum hi + lo of two floats for about 48 bits of mantissa
+// Runs on devices without doubles (or with slow ones) past the float kernel's precision
+// Offsets and scales are float2 (hi, lo) pairs, see mandelbrot_func.split_float_float
+// Only z_power 2 is supported, the z_power argument is there to match the other kernels' arguments
+
+// Periodicity tolerance as a fraction of a pixel
+#ifndef PERIOD_TOLERANCE
+#define PERIOD_TOLERANCE 1e-3
+#endif
+
+// Output type, narrower types cut the copy back to the host, float holds SMOOTH fractional counts
+#ifndef OUT_T
+#define OUT_T long
+#endif
+
+// DEPTH and CUTOFF can be fixed at build time, replacing the depth and cutoff arguments
+
+#ifdef SMOOTH
+typedef float count_t;
+#else
+typedef int count_t;
+#endif
+
+// The error terms are only right if a*b+c is never fused or reordered behind our back
+#pragma OPENCL FP_CONTRACT OFF
+
+    // a + b exactly, as the rounded sum and its error
+    float2 two_sum(float a, float b)
+    {{
+        float s = a + b;
+        float v = s - a;
+        return (float2)(s, (a - (s - v)) + (b - v));
+    }}
+
+    // Same as two_sum when |a| >= |b|
+    float2 quick_two_sum(float a, float b)
+    {{
+        float s = a + b;
+        return (float2)(s, b - (s - a));
+    }}
+
+    // a * b exactly, fma gives the error of the rounded product
+    float2 two_prod(float a, float b)
+    {{
+        float p = a * b;
+        return (float2)(p, fma(a, b, -p));
+    }}
+
+    float2 ff_add(float2 a, float2 b)
+    {{
+        float2 s = two_sum(a.x, b.x);
+        float2 t = two_sum(a.y, b.y);
+        s = quick_two_sum(s.x, s.y + t.x);
+        return quick_two_sum(s.x, s.y + t.y);
+    }}
+
+    float2 ff_sub(float2 a, float2 b)
+    {{
+        return ff_add(a, -b);
+    }}
+
+    float2 ff_mul(float2 a, float2 b)
+    {{
+        float2 p = two_prod(a.x, b.x);
+        return quick_two_sum(p.x, p.y + (a.x*b.y + a.y*b.x));
+    }}
+
+    float2 ff_mul_float(float2 a, float b)
+    {{
+        float2 p = two_prod(a.x, b);
+        return quick_two_sum(p.x, p.y + a.y*b);
+    }}
+
+    // Iterations left when c = x + yi escapes past |z| > cutoff, 0 if it never does
+    // With SMOOTH the fraction of the last iteration is included from how far past cutoff z got
+    count_t znplus1_count(float2 x, float2 y, int depth, float cutoff, float pixel_size)
+    {{
+#ifdef DEPTH
+        depth = DEPTH;
+#endif
+#ifdef CUTOFF
+        cutoff = CUTOFF;
+#endif
+        float cutoff_sq = cutoff * cutoff;
+
+        float2 zr = (float2)(0, 0);
+        float2 zi = (float2)(0, 0);
+
+        int count = depth;
+
+#ifdef INTERIOR_CHECK
+        // Points in the main cardioid or the period 2 bulb never escape, tested at full precision
+        // as deep zooms can sit right on their edges
+        float2 xq = ff_add(x, (float2)(-0.25f, 0));
+        float2 y_sq = ff_mul(y, y);
+        float2 q = ff_add(ff_mul(xq, xq), y_sq);
+        float2 x1 = ff_add(x, (float2)(1, 0));
+        if (ff_sub(ff_mul(q, ff_add(q, xq)), ff_mul_float(y_sq, 0.25f)).x <= 0
+            || ff_add(ff_mul(x1, x1), y_sq).x <= 0.0625f)
+        {{
+            count = 0;
+        }}
+
+        // Brent's periodicity check, z is compared to a saved value which is replaced at doubling intervals
+        float period_tolerance = (float)PERIOD_TOLERANCE * pixel_size;
+        float2 zr_saved = zr;
+        float2 zi_saved = zi;
+        int period_check = 1;
+        int period_steps = 0;
+#endif
+
+        for (; count > 0; count--)
+        {{
+            float2 zr_sq = ff_mul(zr, zr);
+            float2 zi_sq = ff_mul(zi, zi);
+            float2 zri = ff_mul(zr, zi);
+
+            zr = ff_add(ff_sub(zr_sq, zi_sq), x);
+            zi = ff_add(ff_add(zri, zri), y);
+
+            if (zr.x*zr.x + zi.x*zi.x > cutoff_sq)
+            {{
+                break;
+            }}
+
+#ifdef INTERIOR_CHECK
+            if (fabs(ff_sub(zr, zr_saved).x) < period_tolerance && fabs(ff_sub(zi, zi_saved).x) < period_tolerance)
+            {{
+                count = 0;
+                break;
+            }}
+            if (++period_steps == period_check)
+            {{
+                period_steps = 0;
+                period_check *= 2;
+                zr_saved = zr;
+                zi_saved = zi;
+            }}
+#endif
+        }}
+
+#ifdef SMOOTH
+        if (count > 0)
+        {{
+            return count - 1 + clamp(log2(log(hypot(zr.x, zi.x)) / log(cutoff)), 0.0f, 1.0f);
+        }}
+#endif
+
+        return count;
+    }}
+
+    // Pixel x_pixel, y_pixel in the complex plane, scale * unscaled + offset at float-float precision
+    void get_point(float x_pixel, float y_pixel, float xmax, float xmin, float ymax, float ymin, int width, int height,
+                   float2 xoffset, float2 yoffset, float2 xscale, float2 yscale, float2 *x, float2 *y)
+    {{
+        float x_unscaled = (xmax - xmin)*(x_pixel/(float)width) + xmin;
+        float y_unscaled = (ymax - ymin)*(y_pixel/(float)height) + ymin;
+
+        *x = ff_add(ff_mul_float(xscale, x_unscaled), xoffset);
+        *y = ff_add(ff_mul_float(yscale, y_unscaled), yoffset);
+    }}
+
+    // 2D launch, dimension 0 runs down a column of the frame so neighbouring work items write neighbouring counts
+    // Each work item does pixels_per_item pixels along its row
+    kernel void znplus1(
+    global OUT_T *out_buf,
+            int pixels_per_item,
+            float xmax,
+            float xmin,
+            float ymax,
+            float ymin,
+            int width,
+            int height,
+            float2 xoffset,
+            float2 yoffset,
+            float2 xscale,
+            float2 yscale,
+            int depth,
+            float z_power,
+            float cutoff)
+    {{
+        // The global size is padded up to a multiple of the work-group shape
+        int y_int = get_global_id(0);
+        if (y_int >= height)
+        {{
+            return;
+        }}
+
+        int x_end = min(width, ((int)get_global_id(1) + 1)*pixels_per_item);
+        for (int x_int = get_global_id(1)*pixels_per_item; x_int < x_end; x_int++)
+        {{
+            float2 x, y;
+            get_point(x_int, y_int, xmax, xmin, ymax, ymin, width, height, xoffset, yoffset, xscale, yscale, &x, &y);
+
+            out_buf[x_int*height + y_int] = znplus1_count(x, y, depth, cutoff, xscale.x*(xmax - xmin)/width);
+        }}
+    }}
+
+    // Same as znplus1 for a list of (possibly fractional) pixel positions
+    kernel void znplus1_points(
+    global OUT_T *out_buf,
+    global const float2 *points,
+            float xmax,
+            float xmin,
+            float ymax,
+            float ymin,
+            int width,
+            int height,
+            float2 xoffset,
+            float2 yoffset,
+            float2 xscale,
+            float2 yscale,
+            int depth,
+            float z_power,
+            float cutoff)
+    {{
+        int gid = get_global_id(0);
+        float2 point = points[gid];
+
+        float2 x, y;
+        get_point(point.x, point.y, xmax, xmin, ymax, ymin, width, height, xoffset, yoffset, xscale, yscale, &x, &y);
+
+        out_buf[gid] = znplus1_count(x, y, depth, cutoff, xscale.x*(xmax - xmin)/width);
+    }}
+
+    // Same as znplus1 for the part of the frame starting at x_start, y_start, out_buf is region_height pixels high
+    kernel void znplus1_region(
+    global OUT_T *out_buf,
+            int x_start,
+            int y_start,
+            int region_height,
+            float xmax,
+            float xmin,
+            float ymax,
+            float ymin,
+            int width,
+            int height,
+            float2 xoffset,
+            float2 yoffset,
+            float2 xscale,
+            float2 yscale,
+            int depth,
+            float z_power,
+            float cutoff)
+    {{
+        int gid = get_global_id(0);
+
+        int x_int = x_start + gid/region_height;
+        int y_int = y_start + gid%region_height;
+
+        float2 x, y;
+        get_point(x_int, y_int, xmax, xmin, ymax, ymin, width, height, xoffset, yoffset, xscale, yscale, &x, &y);
+
+        out_buf[gid] = znplus1_count(x, y, depth, cutoff, xscale.x*(xmax - xmin)/width);
+    }}
@@ -0,0 +1,267 @@
+#pragma OPENCL EXTENSION cl_khr_fp64 : enable
+
+// Periodicity tolerance as a fraction of a pixel
+#ifndef PERIOD_TOLERANCE
+#define PERIOD_TOLERANCE 1e-3
+#endif
+
+// Output type, narrower types cut the copy back to the host, float holds SMOOTH fractional counts
+#ifndef OUT_T
+#define OUT_T long
+#endif
+
+// DEPTH and CUTOFF can be fixed at build time, replacing the depth and cutoff arguments
+
+#ifdef SMOOTH
+typedef float count_t;
+#else
+typedef int count_t;
+#endif
+
+    // Iterates a pixel as a small delta dc from a high precision reference orbit at the view centre.
+    // Only valid for z_power 2: z' = 2*Z*dz + dz^2 + dc
+    // With skip > 0 the pixel starts at iteration skip from the series dz = a*u + b*u^2 + c*u^3, u = dc/series_radius
+    // Returns the iterations left when it escapes, 0 if it never does
+    // With SMOOTH the fraction of the last iteration is included from how far past cutoff z got
+    count_t znplus1_count(
+    global const double2 *orbit,
+            int orbit_len,
+            double dc_real,
+            double dc_imag,
+            int depth,
+            double cutoff,
+            double pixel_size,
+            int skip,
+            double series_radius,
+            double a_real,
+            double a_imag,
+            double b_real,
+            double b_imag,
+            double c_real,
+            double c_imag)
+    {{
+        // Series approximation for the skipped iterations, by Horner's method
+        double u_real = dc_real / series_radius;
+        double u_imag = dc_imag / series_radius;
+
+        double dz_real = c_real*u_real - c_imag*u_imag + b_real;
+        double dz_imag = c_real*u_imag + c_imag*u_real + b_imag;
+        double t_real = dz_real*u_real - dz_imag*u_imag + a_real;
+        double t_imag = dz_real*u_imag + dz_imag*u_real + a_imag;
+        dz_real = t_real*u_real - t_imag*u_imag;
+        dz_imag = t_real*u_imag + t_imag*u_real;
+
+#ifdef DEPTH
+        depth = DEPTH;
+#endif
+#ifdef CUTOFF
+        cutoff = CUTOFF;
+#endif
+        double cutoff_sq = cutoff * cutoff;
+        double z_mag_sq = 0;
+
+        int m = skip;
+        int count = depth - skip;
+
+#ifdef INTERIOR_CHECK
+        // Points in the main cardioid or the period 2 bulb never escape, the reference's c is orbit[1]
+        double x = orbit[1].x + dc_real;
+        double y = orbit[1].y + dc_imag;
+        double xq = x - 0.25;
+        double q = xq*xq + y*y;
+        if (q*(q + xq) <= 0.25*y*y || (x + 1)*(x + 1) + y*y <= 0.0625)
+        {{
+            count = 0;
+        }}
+
+        // Brent's periodicity check, z is compared to a saved value which is replaced at doubling intervals
+        double period_tolerance = PERIOD_TOLERANCE * pixel_size;
+        double z_saved_real = orbit[m].x + dz_real;
+        double z_saved_imag = orbit[m].y + dz_imag;
+        int period_check = 1;
+        int period_steps = 0;
+#endif
+
+        for (; count > 0; count--)
+        {{
+            double2 ref = orbit[m];
+
+            double dz_real_next = 2*(ref.x*dz_real - ref.y*dz_imag) + dz_real*dz_real - dz_imag*dz_imag + dc_real;
+            double dz_imag_next = 2*(ref.x*dz_imag + ref.y*dz_real) + 2*dz_real*dz_imag + dc_imag;
+            dz_real = dz_real_next;
+            dz_imag = dz_imag_next;
+            m++;
+
+            ref = orbit[m];
+            double z_real = ref.x + dz_real;
+            double z_imag = ref.y + dz_imag;
+            z_mag_sq = z_real*z_real + z_imag*z_imag;
+
+            if (z_mag_sq > cutoff_sq)
+            {{
+                break;
+            }}
+
+#ifdef INTERIOR_CHECK
+            if (fabs(z_real - z_saved_real) < period_tolerance && fabs(z_imag - z_saved_imag) < period_tolerance)
+            {{
+                count = 0;
+                break;
+            }}
+            if (++period_steps == period_check)
+            {{
+                period_steps = 0;
+                period_check *= 2;
+                z_saved_real = z_real;
+                z_saved_imag = z_imag;
+            }}
+#endif
+
+            // Glitch detection: once the pixel is closer to 0 than to the reference, or the reference
+            // orbit has run out, rebase onto the start of the orbit using the full value as the new delta
+            if (z_mag_sq < dz_real*dz_real + dz_imag*dz_imag || m == orbit_len - 1)
+            {{
+                dz_real = z_real;
+                dz_imag = z_imag;
+                m = 0;
+            }}
+        }}
+
+#ifdef SMOOTH
+        if (count > 0)
+        {{
+            return count - 1 + clamp(log2(0.5*log(z_mag_sq) / log(cutoff)), 0.0, 1.0);
+        }}
+#endif
+
+        return count;
+    }}
+
+    // 2D launch, dimension 0 runs down a column of the frame so neighbouring work items write neighbouring counts
+    // Each work item does pixels_per_item pixels along its row
+    kernel void znplus1(
+    global OUT_T *out_buf,
+            int pixels_per_item,
+    global const double2 *orbit,
+            int orbit_len,
+            double xmax,
+            double xmin,
+            double ymax,
+            double ymin,
+            int width,
+            int height,
+            double xscale,
+            double yscale,
+            int depth,
+            double cutoff,
+            int skip,
+            double series_radius,
+            double a_real,
+            double a_imag,
+            double b_real,
+            double b_imag,
+            double c_real,
+            double c_imag)
+    {{
+        // The global size is padded up to a multiple of the work-group shape
+        int y_int = get_global_id(0);
+        if (y_int >= height)
+        {{
+            return;
+        }}
+
+        // Offset from the reference point, which is the view centre
+        double y_unscaled = (ymax - ymin)*(y_int/(double)height) + ymin;
+        double dc_imag = yscale * y_unscaled;
+
+        int x_end = min(width, ((int)get_global_id(1) + 1)*pixels_per_item);
+        for (int x_int = get_global_id(1)*pixels_per_item; x_int < x_end; x_int++)
+        {{
+            double x_unscaled = (xmax - xmin)*(x_int/(double)width) + xmin;
+            double dc_real = xscale * x_unscaled;
+
+            out_buf[x_int*height + y_int] = znplus1_count(orbit, orbit_len, dc_real, dc_imag, depth, cutoff, xscale*(xmax - xmin)/width,
+                                                          skip, series_radius, a_real, a_imag, b_real, b_imag, c_real, c_imag);
+        }}
+    }}
+
+    // Same as znplus1 for a list of (possibly fractional) pixel positions
+    kernel void znplus1_points(
+    global OUT_T *out_buf,
+    global const float2 *points,
+    global const double2 *orbit,
+            int orbit_len,
+            double xmax,
+            double xmin,
+            double ymax,
+            double ymin,
+            int width,
+            int height,
+            double xscale,
+            double yscale,
+            int depth,
+            double cutoff,
+            int skip,
+            double series_radius,
+            double a_real,
+            double a_imag,
+            double b_real,
+            double b_imag,
+            double c_real,
+            double c_imag)
+    {{
+        int gid = get_global_id(0);
+        float2 point = points[gid];
+
+        double x_unscaled = (xmax - xmin)*(point.x/(double)width) + xmin;
+        double y_unscaled = (ymax - ymin)*(point.y/(double)height) + ymin;
+
+        double dc_real = xscale * x_unscaled;
+        double dc_imag = yscale * y_unscaled;
+
+        out_buf[gid] = znplus1_count(orbit, orbit_len, dc_real, dc_imag, depth, cutoff, xscale*(xmax - xmin)/width,
+                                     skip, series_radius, a_real, a_imag, b_real, b_imag, c_real, c_imag);
+    }}
+
+    // Same as znplus1 for the part of the frame starting at x_start, y_start, out_buf is region_height pixels high
+    kernel void znplus1_region(
+    global OUT_T *out_buf,
+            int x_start,
+            int y_start,
+            int region_height,
+    global const double2 *orbit,
+            int orbit_len,
+            double xmax,
+            double xmin,
+            double ymax,
+            double ymin,
+            int width,
+            int height,
+            double xscale,
+            double yscale,
+            int depth,
+            double cutoff,
+            int skip,
+            double series_radius,
+            double a_real,
+            double a_imag,
+            double b_real,
+            double b_imag,
+            double c_real,
+            double c_imag)
+    {{
+        int gid = get_global_id(0);
+
+        int x_int = x_start + gid/region_height;
+        int y_int = y_start + gid%region_height;
+
+        double x_unscaled = (xmax - xmin)*(x_int/(double)width) + xmin;
+        double y_unscaled = (ymax - ymin)*(y_int/(double)height) + ymin;
+
+        // Offset from the reference point, which is the view centre
+        double dc_real = xscale * x_unscaled;
+        double dc_imag = yscale * y_unscaled;
+
+        out_buf[gid] = znplus1_count(orbit, orbit_len, dc_real, dc_imag, depth, cutoff, xscale*(xmax - xmin)/width,
+                                     skip, series_radius, a_real, a_imag, b_real, b_imag, c_real, c_imag);
+    }}
@@ -0,0 +1,119 @@
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+import pyopencl as cl
+
+from CL.mandelbrot_func import get_kernel, get_global_size, DEFAULT_LAUNCH, PROGRAM_CACHE_DIR
+
+# Work-group shapes (rows, columns) and pixels per work item tried for each device and kernel variant,
+# None leaves the shape to the driver
+LOCAL_SIZES = [None, (8, 8), (16, 4), (32, 1), (32, 4), (64, 1)]
+PIXELS_PER_ITEM = [1, 2, 4]
+# Renders timed per launch, the fastest counts so a stray slow run doesn't rule a launch out
+TUNE_REPEATS = 2
+# Only this fraction of the frame's columns, from its middle, is rendered for each timing
+TUNE_FRACTION = 0.125
+
+# Best launch per device and kernel variant, kept across runs like the program binaries
+LAUNCH_CACHE_PATH = None if PROGRAM_CACHE_DIR is None else os.path.join(PROGRAM_CACHE_DIR, "launches.json")
+
+_launches = {}
+
+
+# A launch is only reused on the same device and driver, for the same source and options
+def get_launch_key(device, kernel_filename, options):
+    with open(kernel_filename) as f:
+        kernel = f.read()
+    key = "\n".join([device.platform.name, device.platform.version, device.name, device.driver_version,
+                     " ".join(options), kernel])
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+# Launches the device can run the program's znplus1 with
+def get_candidate_launches(device, program):
+    max_group_size = get_kernel(program, 'znplus1').get_work_group_info(cl.kernel_work_group_info.WORK_GROUP_SIZE, device)
+    max_item_sizes = device.max_work_item_sizes
+
+    local_sizes = [local_size for local_size in LOCAL_SIZES
+                   if local_size is None or (local_size[0] * local_size[1] <= max_group_size
+                                             and all(size <= limit for size, limit in zip(local_size, max_item_sizes)))]
+    return [(local_size, pixels_per_item) for local_size in local_sizes for pixels_per_item in PIXELS_PER_ITEM]
+
+
+# Seconds to render the middle TUNE_FRACTION of the frame's columns with launch, None if the device can't run it
+def time_launch(queue, program, out_np, out_buf, scalar_args, scalar_arg_types, launch, repeats=TUNE_REPEATS):
+    local_size, pixels_per_item = launch
+    width, height = out_np.shape
+    columns = max(1, int(width * TUNE_FRACTION))
+    global_offset = 0, (width - columns) // 2 // pixels_per_item
+
+    kernel = get_kernel(program, 'znplus1')
+    kernel.set_scalar_arg_dtypes([None, np.int32] + scalar_arg_types[1:])
+
+    times = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        try:
+            kernel(queue, get_global_size((columns, height), local_size, pixels_per_item), local_size, out_buf,
+                   pixels_per_item, *scalar_args, global_offset=global_offset)
+            queue.finish()
+        except cl.Error:
+            # Out of resources for this shape
+            return None
+        times.append(time.perf_counter() - start_time)
+
+    return min(times)
+
+
+# Time every candidate launch rendering into out_buf, returns the fastest and {launch: seconds}
+def tune_launch(queue, program, out_np, out_buf, scalar_args, scalar_arg_types, repeats=TUNE_REPEATS):
+    # The first launch also pays for compiling the kernel on some drivers
+    time_launch(queue, program, out_np, out_buf, scalar_args, scalar_arg_types, DEFAULT_LAUNCH, 1)
+
+    timings = {}
+    for launch in get_candidate_launches(queue.device, program):
+        seconds = time_launch(queue, program, out_np, out_buf, scalar_args, scalar_arg_types, launch, repeats)
+        if seconds is not None:
+            timings[launch] = seconds
+
+    return min(timings, key=timings.get, default=DEFAULT_LAUNCH), timings
+
+
+def _load_launches(path):
+    try:
+        with open(path) as f:
+            return {key: (tuple(local_size) if local_size else None, pixels_per_item)
+                    for key, (local_size, pixels_per_item) in json.load(f).items()}
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_launch(path, key, launch):
+    launches = _load_launches(path)
+    launches[key] = launch
+
+    # Write then rename so another process never reads half a file
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(launches, f, indent=2)
+    os.replace(temp_path, path)
+
+
+# Best launch for program, built from kernel_filename with options, on the queue's device
+# Tuned on this render the first time the device and kernel variant are seen, then read back from path
+def get_launch(queue, program, kernel_filename, options, out_np, out_buf, scalar_args, scalar_arg_types,
+               path=LAUNCH_CACHE_PATH):
+    key = get_launch_key(queue.device, kernel_filename, options)
+    if key not in _launches and path is not None:
+        _launches.update(_load_launches(path))
+
+    if key not in _launches:
+        _launches[key], _ = tune_launch(queue, program, out_np, out_buf, scalar_args, scalar_arg_types)
+        if path is not None:
+            _save_launch(path, key, _launches[key])
+
+    return _launches[key]
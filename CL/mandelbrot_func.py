@@ -1,15 +1,121 @@
-import time
+import time, os, hashlib, threading
+from decimal import Decimal
 
 import numpy as np
 import pyopencl as cl
-
-import matplotlib.pyplot as plt
+import pyopencl.cltypes
 
 
 _WRITE_ONLY = mf = cl.mem_flags.WRITE_ONLY
+_READ_ONLY_COPY = cl.mem_flags.READ_ONLY | cl.mem_flags.COPY_HOST_PTR
+_READ_WRITE_HOST = cl.mem_flags.READ_WRITE | cl.mem_flags.USE_HOST_PTR
+
+# Output arrays start on a page boundary, which some drivers need before they'll use host memory in place
+HOST_ALIGNMENT = 4096
+
+# OpenCL C type the kernels write for each output dtype
+OUT_TYPES = {np.dtype(np.int64): 'long',
+             np.dtype(np.uint32): 'uint',
+             np.dtype(np.uint16): 'ushort',
+             np.dtype(np.float32): 'float'}
+
+# Argument types of the float (kernel.c) and double (kernel_double.c) kernels
+SCALAR_ARG_TYPES_GPU = [None,
+         np.float32,
+         np.float32,
+         np.float32,
+         np.float32,
+         np.int32,
+         np.int32,
+         np.float32,
+         np.float32,
+         np.float32,
+         np.float32,
+         np.int32,
+         np.float32,
+         np.float32]
 
+SCALAR_ARG_TYPES_CPU = [None,
+         np.double,
+         np.double,
+         np.double,
+         np.double,
+         np.int32,
+         np.int32,
+         np.double,
+         np.double,
+         np.double,
+         np.double,
+         np.int32,
+         np.double,
+         np.double]
 
-def create_cl_context_and_queue(use_gpu=True):
+# Argument types of the float-float kernel (kernel_float_float.c), offsets and scales are (hi, lo) pairs
+SCALAR_ARG_TYPES_FLOAT_FLOAT = [None,
+         np.float32,
+         np.float32,
+         np.float32,
+         np.float32,
+         np.int32,
+         np.int32,
+         cl.cltypes.float2,
+         cl.cltypes.float2,
+         cl.cltypes.float2,
+         cl.cltypes.float2,
+         np.int32,
+         np.float32,
+         np.float32]
+
+# Work-group shape and pixels per work item of a znplus1 launch, the driver picks the shape by default
+DEFAULT_LAUNCH = None, 1
+
+# Point launches are padded to a multiple of this many points
+POINTS_BLOCK = 256
+
+# Highest integer power given its own kernel variant, z^n is n-1 complex multiplies
+MAX_SPECIALISED_POWER = 8
+
+# Built program binaries are kept here so later runs skip compiling, None disables the cache
+PROGRAM_CACHE_DIR = os.environ.get("MANDELBROT_CL_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "mandelbrot_cl"))
+
+
+# Called with (name, event) for every kernel launch and copy, see set_event_callback
+_event_callback = None
+
+
+# callback(name, event) gets each kernel and copy event, e.g. profiling.record_event, None stops it
+def set_event_callback(callback):
+    global _event_callback
+    _event_callback = callback
+
+
+def _record_event(name, event):
+    if _event_callback:
+        _event_callback(name, event)
+
+
+# Kernels already created, per thread as a kernel's arguments are set on it for each launch
+_kernels = threading.local()
+
+
+# The kernel called name in program, created once with cl.Kernel and reused after
+# Looking it up as program.<name> makes a new kernel (and a pyopencl warning) every time
+def get_kernel(program, name):
+    kernels = _kernels.__dict__.setdefault('kernels', {})
+    if (program, name) not in kernels:
+        kernels[program, name] = cl.Kernel(program, name)
+    return kernels[program, name]
+
+
+# value (a float or Decimal) as a float2 of the nearest float and the float nearest what's left, for the float-float kernel
+def split_float_float(value):
+    hi = np.float32(float(value))
+    lo = np.float32(float(Decimal(value) - Decimal(float(hi))))
+    return cl.cltypes.make_float2(hi, lo)
+
+
+# profiling enables event timestamps on the queue, for device time of each launch and copy
+def create_cl_context_and_queue(use_gpu=True, profiling=False):
     platforms = cl.get_platforms()
     if platforms:
         if use_gpu:
@@ -23,38 +129,193 @@ def create_cl_context_and_queue(use_gpu=True):
     print(f"Using device: {device.name}")
     context = cl.Context(devices=[device])
     # context = cl.create_some_context()
-    queue = cl.CommandQueue(context)
+    queue = cl.CommandQueue(context, properties=cl.command_queue_properties.PROFILING_ENABLE if profiling else 0)
 
     return context, queue, device
 
 
-def create_and_build_program(context, kernel_filename):
+# Build options for the kernels, interior_check enables the cardioid/bulb test and periodicity detection
+# period_tolerance is a fraction of a pixel, out_dtype is the dtype of the output array
+# smooth writes fractional counts and needs a float32 output
+# z_power, depth and cutoff build a variant specialised for those values, the kernel arguments are then ignored
+# Only integer powers up to MAX_SPECIALISED_POWER are specialised, others use the generic kernel
+def create_build_options(interior_check=True, period_tolerance=1e-3, out_dtype=np.int64, smooth=False,
+                         z_power=None, depth=None, cutoff=None):
+    options = [f"-DOUT_T={OUT_TYPES[np.dtype(out_dtype)]}"]
+    if interior_check:
+        options += ["-DINTERIOR_CHECK", f"-DPERIOD_TOLERANCE={period_tolerance}"]
+    if smooth:
+        options += ["-DSMOOTH"]
+    if z_power is not None and z_power == int(z_power) and 2 <= z_power <= MAX_SPECIALISED_POWER:
+        options += [f"-DZ_POWER={int(z_power)}"]
+    if depth is not None:
+        options += [f"-DDEPTH={int(depth)}"]
+    if cutoff is not None:
+        options += [f"-DCUTOFF={float(cutoff)!r}"]
+
+    return options
+
+
+# A binary is only reused on the same device and driver, for the same source and options
+def get_program_cache_path(device, kernel, options, cache_dir=PROGRAM_CACHE_DIR):
+    key = "\n".join([device.platform.name, device.platform.version, device.name, device.driver_version,
+                     " ".join(options), kernel])
+    return os.path.join(cache_dir, hashlib.sha256(key.encode()).hexdigest() + ".bin")
+
+
+def create_and_build_program(context, kernel_filename, options=None, cache_dir=PROGRAM_CACHE_DIR):
     with open(kernel_filename) as f:
         kernel = f.read()
+    options = options or []
+
+    if cache_dir is None:
+        return cl.Program(context, kernel).build(options=options)
+
+    device = context.devices[0]
+    cache_path = get_program_cache_path(device, kernel, options, cache_dir)
+
+    if os.path.exists(cache_path):
+        with open(cache_path, 'rb') as f:
+            binary = f.read()
+        try:
+            return cl.Program(context, [device], [binary]).build(options=options)
+        except (cl.Error, RuntimeError):
+            # Unreadable or stale binary, rebuild it from source below
+            pass
+
+    program = cl.Program(context, kernel).build(options=options)
+
+    # Write then rename so another process never reads half a binary
+    os.makedirs(cache_dir, exist_ok=True)
+    temp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(program.binaries[0])
+    os.replace(temp_path, cache_path)
 
-    program = cl.Program(context, kernel).build(options=[])
     return program
 
 
+# The buffer is readable by kernels too so counts can be coloured on the device
+# It's backed by out_np, so devices that share host memory write the counts straight into it, see read_out_array
 def create_out_array_and_buffer(context, array_shape, dtype=np.float32):
-    out_np = np.zeros(shape=array_shape, dtype=dtype)
-    out_buf = cl.Buffer(context, _WRITE_ONLY, out_np.nbytes)
+    dtype = np.dtype(dtype)
+    nbytes = int(np.prod(array_shape)) * dtype.itemsize
+
+    memory = np.zeros(nbytes + HOST_ALIGNMENT, dtype=np.uint8)
+    start = -memory.ctypes.data % HOST_ALIGNMENT
+    out_np = memory[start:start + nbytes].view(dtype).reshape(array_shape)
+    out_buf = cl.Buffer(context, _READ_WRITE_HOST, hostbuf=out_np)
 
     return out_np, out_buf
 
 
-def calculate_mandelbrot_opencl(queue, program, out_np, out_buf, scalar_args, scalar_arg_types):
-    kernel = program.znplus1
-    kernel.set_scalar_arg_dtypes(scalar_arg_types)
+# Bring what the kernels wrote to out_buf into out_np, returns the event to wait on when not blocking
+# A buffer backed by out_np is mapped and unmapped, no copy on devices that share host memory, others are copied
+def read_out_array(queue, out_np, out_buf, is_blocking=True):
+    if out_buf.flags & cl.mem_flags.USE_HOST_PTR:
+        mapped, _ = cl.enqueue_map_buffer(queue, out_buf, cl.map_flags.READ, 0, out_np.shape, out_np.dtype, is_blocking=False)
+        event = mapped.base.release(queue)
+        if is_blocking:
+            event.wait()
+        return event
+
+    return cl.enqueue_copy(queue, out_np, out_buf, is_blocking=is_blocking)
+
+
+# 2D global size for a width x height frame, each work item doing pixels_per_item pixels along a row
+# Padded up to a multiple of local_size, (rows, columns) of a work group or None for the driver to pick
+def get_global_size(shape, local_size, pixels_per_item):
+    width, height = shape
+    global_size = height, -(-width // pixels_per_item)
+    if local_size is None:
+        return global_size
+    return tuple(-(-size // local) * local for size, local in zip(global_size, local_size))
+
+
+# do_copy=False leaves the counts on the device, for colouring them there
+# launch is (local_size, pixels_per_item), see CL.launch_tuning for picking one per device
+def calculate_mandelbrot_opencl(queue, program, out_np, out_buf, scalar_args, scalar_arg_types, do_copy=True,
+                                launch=DEFAULT_LAUNCH):
+    local_size, pixels_per_item = launch
+
+    kernel = get_kernel(program, 'znplus1')
+    kernel.set_scalar_arg_dtypes([None, np.int32] + scalar_arg_types[1:])
+
+    _record_event("kernel", kernel(queue, get_global_size(out_np.shape, local_size, pixels_per_item), local_size, out_buf,
+                                   pixels_per_item, *scalar_args))
+
+    if do_copy:
+        _record_event("copy", read_out_array(queue, out_np, out_buf))
+
+    return 0
+
+
+# Palette buffer for the colour kernel from a (n, 3) or (n, 4) uint8 array of colours
+def create_palette_buffer(context, palette):
+    rgba = np.full((len(palette), 4), 255, dtype=np.uint8)
+    rgba[:, :palette.shape[1]] = palette
+
+    return cl.Buffer(context, _READ_ONLY_COPY, hostbuf=rgba)
+
 
-    kernel(queue, out_np.flatten().shape, None, out_buf, *scalar_args)
+# Colour the counts left in out_buf by a znplus1 kernel into rgba_np, a (height, width, 4) uint8 array
+# Only the colours are copied back to the host
+def colour_mandelbrot_opencl(queue, colour_program, rgba_np, rgba_buf, out_buf, palette_buf, palette_size, palette_scale=1.0):
+    height, width, _ = rgba_np.shape
 
-    cl.enqueue_copy(queue, out_np, out_buf)
+    kernel = get_kernel(colour_program, 'colour')
+    kernel.set_scalar_arg_dtypes([None, None, None, np.int32, np.float32, np.int32, np.int32])
+
+    _record_event("colour_kernel", kernel(queue, (width * height,), None, rgba_buf, out_buf, palette_buf, palette_size,
+                                          palette_scale, width, height))
+
+    _record_event("colour_copy", read_out_array(queue, rgba_np, rgba_buf))
+
+    return 0
+
+
+# Calculate the part of the frame starting at pixel origin into out_np, which has the shape of the part
+def calculate_region_opencl(queue, program, out_np, out_buf, origin, scalar_args, scalar_arg_types):
+    x_start, y_start = origin
+
+    kernel = get_kernel(program, 'znplus1_region')
+    kernel.set_scalar_arg_dtypes([None, np.int32, np.int32, np.int32] + scalar_arg_types[1:])
+
+    _record_event("region_kernel", kernel(queue, (out_np.size,), None, out_buf, x_start, y_start, out_np.shape[1], *scalar_args))
+
+    _record_event("region_copy", read_out_array(queue, out_np, out_buf))
 
     return 0
 
 
+# Calculate just the given (n, 2) array of pixel positions with znplus1_points, returns their n counts
+def calculate_points_opencl(queue, program, points, scalar_args, scalar_arg_types, dtype=np.int64):
+    count = len(points)
+    if not count:
+        return np.empty(0, dtype=dtype)
+
+    # Some drivers (pocl) compile the kernel again for every new work-group size they pick, padding the count
+    # to a multiple of POINTS_BLOCK keeps the launches to a few sizes however many points there are
+    padding = -count % POINTS_BLOCK
+    points = np.ascontiguousarray(np.pad(points, ((0, padding), (0, 0)), mode='edge'), dtype=np.float32)
+    out_np = np.empty(len(points), dtype=dtype)
+
+    points_buf = cl.Buffer(queue.context, _READ_ONLY_COPY, hostbuf=points)
+    out_buf = cl.Buffer(queue.context, _WRITE_ONLY, out_np.nbytes)
+
+    kernel = get_kernel(program, 'znplus1_points')
+    kernel.set_scalar_arg_dtypes([None, None] + scalar_arg_types[1:])
+
+    _record_event("points_kernel", kernel(queue, out_np.shape, None, out_buf, points_buf, *scalar_args))
+
+    _record_event("points_copy", cl.enqueue_copy(queue, out_np, out_buf))
+
+    return out_np[:count]
+
+
 def _run_test():
+    import matplotlib.pyplot as plt
+
     SHAPE = WIDTH, HEIGHT = 1323, 761
     XMIN, XMAX = -2, 2
     YMIN, YMAX = -2, 2
@@ -111,6 +372,8 @@ def _run_test():
 
 
 def _run_test_cpu():
+    import matplotlib.pyplot as plt
+
     SHAPE = WIDTH, HEIGHT = 1024, 1024
     XMIN, XMAX = -2, 2
     YMIN, YMAX = -2, 2
@@ -0,0 +1,139 @@
+import threading
+import time
+
+import numpy as np
+import pyopencl as cl
+
+from CL.mandelbrot_func import create_and_build_program, calculate_region_opencl, calculate_points_opencl
+
+_WRITE_ONLY = cl.mem_flags.WRITE_ONLY
+
+# A device never takes fewer rows, or points, than this at a time
+MIN_BAND_ROWS = 8
+MIN_RUN_POINTS = 4096
+# Weight of the latest measured throughput against the running estimate
+THROUGHPUT_SMOOTHING = 0.5
+
+
+# Every device of device_type on every platform
+# fission splits CPU devices into sub-devices of that many compute units, where the platform supports it
+def get_all_devices(device_type=cl.device_type.ALL, fission=None):
+    devices = []
+    for platform in cl.get_platforms():
+        try:
+            platform_devices = platform.get_devices(device_type=device_type)
+        except cl.Error:
+            # None of that type on this platform
+            continue
+
+        for device in platform_devices:
+            if fission and device.type & cl.device_type.CPU and device.max_compute_units > fission:
+                try:
+                    devices += device.create_sub_devices([cl.device_partition_property.EQUALLY, fission])
+                    continue
+                except cl.Error:
+                    pass
+            devices.append(device)
+
+    return devices
+
+
+# Renders frames, or lists of points, across several devices, each with its own context, queue and program
+# Work is handed out in chunks as each device finishes its last one, a device's chunk is its share of half the
+# work left by measured throughput, so the chunks shrink towards the end and no device is left waiting on
+# another's expensive chunk
+class MultiDeviceRenderer:
+    # profiling enables event timestamps on the queues, as create_cl_context_and_queue does
+    def __init__(self, devices, kernel_filename, options=None, needs_double=False, profiling=False):
+        self.devices = [device for device in devices if device.double_fp_config or not needs_double]
+        if not self.devices:
+            raise ValueError(f"No device can run {kernel_filename}")
+        self.contexts = [cl.Context(devices=[device]) for device in self.devices]
+        properties = cl.command_queue_properties.PROFILING_ENABLE if profiling else 0
+        self.queues = [cl.CommandQueue(context, properties=properties) for context in self.contexts]
+        self.programs = [create_and_build_program(context, kernel_filename, options) for context in self.contexts]
+
+        # Pixels per second of each device, None until it has been measured
+        self.throughputs = [None] * len(self.devices)
+        # Pixels each device computed in the last render
+        self.last_pixels = [0] * len(self.devices)
+        self._band_buffers = [None] * len(self.devices)
+
+    def _get_band_buffer(self, i, nbytes):
+        if self._band_buffers[i] is None or self._band_buffers[i].size < nbytes:
+            self._band_buffers[i] = cl.Buffer(self.contexts[i], _WRITE_ONLY, nbytes)
+        return self._band_buffers[i]
+
+    # Split count items, each item_pixels pixels, across the devices in chunks of at least min_chunk items
+    # render_chunk(i, start, stop) renders items start to stop on device i
+    def _split(self, count, min_chunk, item_pixels, render_chunk):
+        measured = [t for t in self.throughputs if t]
+        shares = [t or (sum(measured) / len(measured) if measured else 1) for t in self.throughputs]
+        total_share = sum(shares)
+
+        lock = threading.Lock()
+        next_item = 0
+        items_done = [0] * len(self.devices)
+        busy_times = [0.0] * len(self.devices)
+        errors = []
+
+        def take_chunk(i):
+            nonlocal next_item
+            with lock:
+                remaining = count - next_item
+                if remaining <= 0:
+                    return None
+                items = min(remaining, max(min_chunk, int(remaining * shares[i] / total_share / 2)))
+                next_item += items
+                return next_item - items, next_item
+
+        def run_device(i):
+            try:
+                while (chunk := take_chunk(i)) is not None:
+                    start_time = time.perf_counter()
+                    render_chunk(i, *chunk)
+                    busy_times[i] += time.perf_counter() - start_time
+                    items_done[i] += chunk[1] - chunk[0]
+            except Exception as error:
+                errors.append(error)
+
+        threads = [threading.Thread(target=run_device, args=(i,)) for i in range(len(self.devices))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if errors:
+            raise errors[0]
+
+        for i, (items, busy_time) in enumerate(zip(items_done, busy_times)):
+            if items and busy_time > 0:
+                throughput = items * item_pixels / busy_time
+                old = self.throughputs[i]
+                self.throughputs[i] = throughput if old is None else THROUGHPUT_SMOOTHING * throughput + (1 - THROUGHPUT_SMOOTHING) * old
+        self.last_pixels = [items * item_pixels for items in items_done]
+
+    # Render the frame into out_np in bands of rows
+    # scalar_args has the kernel's arguments for each device's context, in self.contexts order
+    def render(self, out_np, scalar_args, scalar_arg_types):
+        width, height = out_np.shape
+
+        def render_band(i, y_start, y_stop):
+            band_np = np.empty((width, y_stop - y_start), dtype=out_np.dtype)
+            calculate_region_opencl(self.queues[i], self.programs[i], band_np, self._get_band_buffer(i, band_np.nbytes),
+                                    (0, y_start), scalar_args[i], scalar_arg_types)
+            out_np[:, y_start:y_stop] = band_np
+
+        self._split(height, MIN_BAND_ROWS, width, render_band)
+        return 0
+
+    # Counts of an (n, 2) array of pixel positions like calculate_points_opencl, split into runs of points
+    def render_points(self, points, scalar_args, scalar_arg_types, dtype=np.int64):
+        out_np = np.empty(len(points), dtype=dtype)
+
+        def render_run(i, start, stop):
+            out_np[start:stop] = calculate_points_opencl(self.queues[i], self.programs[i], points[start:stop], scalar_args[i],
+                                                         scalar_arg_types, dtype)
+
+        self._split(len(points), MIN_RUN_POINTS, 1, render_run)
+        return out_np
@@ -0,0 +1,138 @@
+import math
+from decimal import Decimal, getcontext
+
+import numpy as np
+import pyopencl as cl
+
+
+_READ_ONLY_COPY = cl.mem_flags.READ_ONLY | cl.mem_flags.COPY_HOST_PTR
+
+SCALAR_ARG_TYPES_PERTURBATION = [None,
+         None,
+         np.int32,
+         np.double,
+         np.double,
+         np.double,
+         np.double,
+         np.int32,
+         np.int32,
+         np.double,
+         np.double,
+         np.int32,
+         np.double,
+         np.int32,
+         np.double,
+         np.double,
+         np.double,
+         np.double,
+         np.double,
+         np.double,
+         np.double]
+
+# Enough digits to resolve a pixel at the given scale, with room to spare
+DECIMAL_GUARD_DIGITS = 20
+
+# Never skip so far that fewer than this many iterations are left before the reference ends
+SERIES_MIN_REMAINING = 16
+
+_last_orbit_key = None
+_last_orbit = None
+
+
+def set_decimal_precision(scale):
+    getcontext().prec = max(28, int(-math.log10(scale)) + DECIMAL_GUARD_DIGITS)
+
+
+# Iterate the view centre in arbitrary precision, returns Z_0..Z_n as doubles
+def compute_reference_orbit(x_ref, y_ref, depth, cutoff):
+    global _last_orbit_key, _last_orbit
+
+    x_ref, y_ref = Decimal(x_ref), Decimal(y_ref)
+    orbit_key = (x_ref, y_ref, depth, cutoff, getcontext().prec)
+    if orbit_key == _last_orbit_key:
+        return _last_orbit
+
+    bailout = Decimal(cutoff) ** 2
+    orbit = np.zeros((depth + 1, 2), dtype=np.double)
+
+    z_real = z_imag = Decimal(0)
+    for n in range(1, depth + 1):
+        z_real, z_imag = z_real*z_real - z_imag*z_imag + x_ref, 2*z_real*z_imag + y_ref
+        orbit[n] = float(z_real), float(z_imag)
+
+        # The kernel rebases any pixel that outlives the reference
+        if z_real*z_real + z_imag*z_imag > bailout:
+            orbit = orbit[:n + 1]
+            break
+
+    _last_orbit_key, _last_orbit = orbit_key, orbit
+    return orbit
+
+
+# Fit dz_n = a*u + b*u^2 + c*u^3 with u = dc/radius along the orbit, checked against exact probe orbits
+# Returns the last iteration every probe stays within tolerance (relative error) and the coefficients there
+def compute_series_approximation(orbit, radius, probes, tolerance, cutoff):
+    a = b = c = 0j
+    probe_dz = [0j] * len(probes)
+    cutoff_sq = cutoff * cutoff
+
+    skip, coefficients = 0, (0j, 0j, 0j)
+    for n in range(len(orbit) - SERIES_MIN_REMAINING):
+        ref = complex(*orbit[n])
+
+        a, b, c = 2*ref*a + radius, 2*ref*b + a*a, 2*ref*c + 2*a*b
+        ref_next = complex(*orbit[n + 1])
+
+        for i, dc in enumerate(probes):
+            dz = 2*ref*probe_dz[i] + probe_dz[i]*probe_dz[i] + dc
+            probe_dz[i] = dz
+
+            u = dc / radius
+            series_dz = ((c*u + b)*u + a)*u
+
+            z = ref_next + dz
+            if z.real*z.real + z.imag*z.imag > cutoff_sq or abs(series_dz - dz) > tolerance * abs(dz):
+                return skip, coefficients
+
+        skip, coefficients = n + 1, (a, b, c)
+
+    return skip, coefficients
+
+
+# Offsets from the view centre of the corners and edge midpoints, for checking the series
+def get_series_probes(xmax, xmin, ymax, ymin, xscale, yscale):
+    return [complex(x * xscale, y * yscale)
+            for x in (xmin, (xmin + xmax) / 2, xmax)
+            for y in (ymin, (ymin + ymax) / 2, ymax)
+            if (x, y) != ((xmin + xmax) / 2, (ymin + ymax) / 2)]
+
+
+def create_orbit_buffer(context, orbit):
+    return cl.Buffer(context, _READ_ONLY_COPY, hostbuf=orbit)
+
+
+# Scalar arguments for kernel_perturbation.c, the view centre is taken by the reference orbit
+# series is (skip, radius, (a, b, c)), None doesn't skip any iterations
+def get_perturbation_args(orbit_buf, orbit, xmax, xmin, ymax, ymin, width, height, xscale, yscale, depth, cutoff, series=None):
+    skip, radius, (a, b, c) = series or (0, 1, (0j, 0j, 0j))
+
+    return (orbit_buf,
+            np.int32(len(orbit)),
+            np.double(xmax),
+            np.double(xmin),
+            np.double(ymax),
+            np.double(ymin),
+            np.int32(width),
+            np.int32(height),
+            np.double(xscale),
+            np.double(yscale),
+            np.int32(depth),
+            np.double(cutoff),
+            np.int32(skip),
+            np.double(radius),
+            np.double(a.real),
+            np.double(a.imag),
+            np.double(b.real),
+            np.double(b.imag),
+            np.double(c.real),
+            np.double(c.imag))
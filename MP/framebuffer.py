@@ -0,0 +1,24 @@
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from MP.project_constants import FRAMEBUFFER_DTYPE, FRAMEBUFFER_UNSET
+
+
+# Create a shared memory block holding one iteration count per pixel
+def create_framebuffer(shape, dtype=FRAMEBUFFER_DTYPE):
+    nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+    shm = shared_memory.SharedMemory(create=True, size=nbytes)
+
+    framebuffer = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    framebuffer.fill(FRAMEBUFFER_UNSET)
+
+    return shm, framebuffer
+
+
+# Attach to a framebuffer created by another process, the shm must be kept alive while the array is used
+def attach_framebuffer(name, shape, dtype=FRAMEBUFFER_DTYPE):
+    shm = shared_memory.SharedMemory(name=name)
+    framebuffer = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+    return shm, framebuffer
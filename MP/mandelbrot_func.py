@@ -2,44 +2,135 @@ import multiprocessing as mp
 import time
 
 from MP.project_constants import *
+from MP.framebuffer import attach_framebuffer
+from mariani_silver import mariani_silver
+
+# Points in the main cardioid or the period 2 bulb, which never escape
+def in_cardioid_or_bulb(c):
+    xq = c.real - 0.25
+    q = xq * xq + c.imag * c.imag
+    return (q * (q + xq) <= 0.25 * c.imag * c.imag) | ((c.real + 1) ** 2 + c.imag * c.imag <= 0.0625)
+
 
 # Iterative Function
-def znplus1(c, z=0, i=DEPTH):
-    if i <= 0 or z > 2:
-        return z
-    else:
-        return znplus1(c, z=(z ** Z_POWER) + (c/SCALE) + XOFFSET + (YOFFSET*1j), i=i - 1)
+# Iterates an array of points at once, returns the iteration each point escaped at (DEPTH if it never did)
+# pixel_size scales the periodicity tolerance, for points that aren't on the PRECISION grid
+def znplus1(c, depth=DEPTH, interior_check=INTERIOR_CHECK, pixel_size=PRECISION / SCALE):
+    c = np.asarray(c, dtype=complex) / SCALE + XOFFSET + (YOFFSET*1j)
+
+    counts = np.full(c.shape, depth, dtype=FRAMEBUFFER_DTYPE)
+    flat_counts = counts.reshape(-1)
+
+    # Only the points which haven't escaped yet are kept
+    index = np.arange(c.size)
+    c = c.reshape(-1)
+
+    if interior_check and Z_POWER == 2:
+        remaining = ~in_cardioid_or_bulb(c)
+        index, c = index[remaining], c[remaining]
+
+    z = np.zeros_like(c)
+
+    # Brent's periodicity check, z is compared to a saved value which is replaced at doubling intervals
+    z_saved = z.copy()
+    period_check = 1
+    period_tolerance = PERIOD_TOLERANCE * pixel_size
+
+    for i in range(depth):
+        if not index.size:
+            break
+
+        z = (z ** Z_POWER) + c
+        escaped = (z.real * z.real + z.imag * z.imag) > 4
+
+        if escaped.any():
+            flat_counts[index[escaped]] = i
+
+        remaining = ~escaped
+        if interior_check:
+            # Periodic points are left at depth
+            diff = z - z_saved
+            remaining &= (np.abs(diff.real) >= period_tolerance) | (np.abs(diff.imag) >= period_tolerance)
 
+            if i + 1 == period_check:
+                period_check *= 2
+                z_saved = z
 
-# Set surfarray file value for x,y pos
-def set_mandelbrot(x, y):
-    surf_array = np.memmap(SURFARRAY_FILENAME, dtype=SURFARRAY_DTYPE, mode='r+', shape=SURFARRAY_SHAPE)
+        if not remaining.all():
+            index, c, z, z_saved = index[remaining], c[remaining], z[remaining], z_saved[remaining]
 
-    num = round(XRANGE[x], PRECISION_ROUND) + (round(YRANGE[y], PRECISION_ROUND) * 1j)
+    return counts
 
-    if znplus1(num) > 2:
-        surf_array[x, y] = 0
+
+# Split the frame into rectangular tiles of at most tile_size x tile_size pixels
+def make_tiles(shape, tile_size):
+    width, height = shape
+    return [(x, min(x + tile_size, width), y, min(y + tile_size, height))
+            for x in range(0, width, tile_size)
+            for y in range(0, height, tile_size)]
+
+
+# Framebuffer each pool worker attaches to once, and the shared count of completed pixels
+_worker_shm = None
+_worker_framebuffer = None
+_worker_pixels_done = None
+_worker_interior_check = INTERIOR_CHECK
+_worker_subdivide = False
+
+def _attach_worker(framebuffer_name, pixels_done, interior_check, subdivide):
+    global _worker_shm, _worker_framebuffer, _worker_pixels_done, _worker_interior_check, _worker_subdivide
+    _worker_shm, _worker_framebuffer = attach_framebuffer(framebuffer_name, SHAPE)
+    _worker_pixels_done = pixels_done
+    _worker_interior_check = interior_check
+    _worker_subdivide = subdivide
+
+
+# Set framebuffer values for a whole tile
+def set_mandelbrot_tile(x0, x1, y0, y1):
+    xnums = np.round(XRANGE[x0:x1], PRECISION_ROUND)
+    ynums = np.round(YRANGE[y0:y1], PRECISION_ROUND) * 1j
+
+    if _worker_subdivide:
+        # Only compute the tile's pixels Mariani-Silver subdivision needs
+        evaluate = lambda xs, ys: znplus1(xnums[xs] + ynums[ys], interior_check=_worker_interior_check)
+        _worker_framebuffer[x0:x1, y0:y1], _ = mariani_silver(evaluate, (x1 - x0, y1 - y0), dtype=FRAMEBUFFER_DTYPE)
     else:
-        surf_array[x, y] = 255
+        nums = xnums[:, np.newaxis] + ynums
+        _worker_framebuffer[x0:x1, y0:y1] = znplus1(nums, interior_check=_worker_interior_check)
+
+    with _worker_pixels_done.get_lock():
+        _worker_pixels_done.value += (x1 - x0) * (y1 - y0)
 
     return 0
 
 
-# Calculate members of the mandelbrot set and write to file
-def calculate_mandelbrot(pipe, progress_value):
-    surf_array = np.memmap(SURFARRAY_FILENAME, dtype=SURFARRAY_DTYPE, mode='w+', shape=SURFARRAY_SHAPE)
-    surf_array.fill(-1)
+# Write percent done, pixels per second and ETA into the progress array
+def report_progress(progress_value, pixels_done, elapsed_time):
+    pixels_per_second = pixels_done / elapsed_time if elapsed_time > 0 else 0
+    eta = (FRAMEBUFFER_LEN - pixels_done) / pixels_per_second if pixels_per_second else 0
+
+    with progress_value.get_lock():
+        progress_value[PROGRESS_PERCENT] = round((pixels_done / FRAMEBUFFER_LEN)*100, 2)
+        progress_value[PROGRESS_RATE] = round(pixels_per_second)
+        progress_value[PROGRESS_ETA] = round(eta, TIME_PRECISION)
 
-    # Inform file is created
-    pipe.send(1)
+
+# Calculate members of the mandelbrot set and write to the shared framebuffer
+# progress_value is an mp.Array('d', 3) indexed by PROGRESS_PERCENT, PROGRESS_RATE and PROGRESS_ETA
+# num_proc of None uses one process per cpu
+def calculate_mandelbrot(pipe, progress_value, framebuffer_name, num_proc=None, chunk_size=1, tile_size=64,
+                         interior_check=INTERIOR_CHECK, subdivide=False):
+    pixels_done = mp.Value('q', 0)
 
     start_time = time.time()
-    with mp.Pool(processes=NUM_PROC) as pool:
-        res = pool.starmap_async(set_mandelbrot, XY_INDEX_RANGE, chunksize=CHUNK_SIZE)
+    with mp.Pool(processes=num_proc, initializer=_attach_worker,
+                 initargs=(framebuffer_name, pixels_done, interior_check, subdivide)) as pool:
+        res = pool.starmap_async(set_mandelbrot_tile, make_tiles(SHAPE, tile_size), chunksize=chunk_size)
 
+        # Sleep until done, waking at a fixed rate to report progress
         while not res.ready():
-            with progress_value.get_lock():
-                progress_value.value = round((np.count_nonzero(surf_array != -1) / SURFARRAY_LEN)*100, 2)
+            res.wait(PROGRESS_INTERVAL)
+            report_progress(progress_value, pixels_done.value, time.time() - start_time)
 
 
     end_time = time.time()
@@ -47,4 +138,4 @@ def calculate_mandelbrot(pipe, progress_value):
 
     pipe.send(total_time)
 
-    return 0
\ No newline at end of file
+    return 0
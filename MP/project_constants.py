@@ -3,10 +3,6 @@ import itertools
 
 SCREEN_WIDTH, SCREEN_HEIGHT = SCREEN_RESOLUTION = (1024, 480)
 
-# MP Constants
-CHUNK_SIZE = 192
-NUM_PROC = 4
-
 # Mandelbrot Constants
 PRECISION = 0.05
 PRECISION_ROUND = min([(n if round(PRECISION, n) == PRECISION else 10) for n in range(8)])
@@ -29,11 +25,18 @@ SHAPE = len(XRANGE), len(YRANGE)
 
 Z_POWER = 2
 
-# Surface Array File Constants
-SURFARRAY_FILENAME = "../surf_array.dat"
-SURFARRAY_DTYPE = 'int'
-SURFARRAY_SHAPE = SHAPE + (3,)
-SURFARRAY_LEN = len(XY_INDEX_RANGE) * 3
+# Interior early-out, periodicity tolerance is a fraction of a pixel
+INTERIOR_CHECK = True
+PERIOD_TOLERANCE = 1e-3
+
+# Shared Framebuffer Constants
+FRAMEBUFFER_DTYPE = np.uint32
+FRAMEBUFFER_UNSET = np.iinfo(FRAMEBUFFER_DTYPE).max
+FRAMEBUFFER_LEN = len(XY_INDEX_RANGE)
+
+# Progress Constants
+PROGRESS_INTERVAL = 0.25
+PROGRESS_PERCENT, PROGRESS_RATE, PROGRESS_ETA = range(3)
 
 # Text Display Constants
 TIME_PRECISION = 2
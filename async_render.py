@@ -0,0 +1,83 @@
+import threading
+
+
+# Runs renders on a worker thread so the caller never waits on the device
+# Only the newest render matters, one submitted while another is queued replaces it,
+# and the result of any render that's been superseded or cancelled is dropped
+class AsyncRenderer:
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._pending = None
+        self._result = None
+        self._latest_id = 0
+        self._running = False
+        self._closed = False
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    # Queue render() for the worker, returns the render's id
+    def submit(self, render):
+        with self._condition:
+            self._latest_id += 1
+            self._pending = self._latest_id, render
+            self._result = None
+            self._condition.notify_all()
+            return self._latest_id
+
+    # Drop the queued render, and the result of one already running
+    def cancel(self):
+        with self._condition:
+            self._latest_id += 1
+            self._pending = None
+            self._result = None
+
+    # Block until the worker has nothing queued or running, after cancel nothing is using what renders were given
+    def wait(self):
+        with self._condition:
+            while self._pending is not None or self._running:
+                self._condition.wait()
+
+    # (render id, what render() returned) once the newest render is done, None until then
+    # An exception in the render is raised here
+    def poll(self):
+        with self._condition:
+            result, self._result = self._result, None
+
+        if result is None:
+            return None
+
+        render_id, value, error = result
+        if error is not None:
+            raise error
+        return render_id, value
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._pending = None
+            self._condition.notify_all()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._pending is None and not self._closed:
+                    self._condition.wait()
+                if self._closed:
+                    return
+                render_id, render = self._pending
+                self._pending = None
+                self._running = True
+
+            value, error = None, None
+            try:
+                value = render()
+            except Exception as exception:
+                error = exception
+
+            with self._condition:
+                self._running = False
+                if render_id == self._latest_id:
+                    self._result = render_id, value, error
+                self._condition.notify_all()
@@ -0,0 +1,204 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+import numpy as np
+
+from CL.mandelbrot_func import create_cl_context_and_queue, create_and_build_program, create_build_options, \
+    create_out_array_and_buffer, calculate_mandelbrot_opencl, read_out_array, SCALAR_ARG_TYPES_GPU, SCALAR_ARG_TYPES_CPU, OUT_TYPES, \
+    SCALAR_ARG_TYPES_FLOAT_FLOAT, split_float_float
+from CL.perturbation import SCALAR_ARG_TYPES_PERTURBATION, set_decimal_precision, compute_reference_orbit, \
+    create_orbit_buffer, get_perturbation_args, compute_series_approximation, get_series_probes
+from capture import write_png, write_raw, get_surface_palette
+
+# Anything a job leaves out, the view is centred on x, y and 4 * scale wide like AppCL
+JOB_DEFAULTS = dict(x=0, y=0, scale=1, depth=250, width=1024, height=1024, z_power=2, cutoff=2, backend='auto')
+
+BACKEND_KERNELS = {'float': "CL/kernel.c",
+                   'float_float': "CL/kernel_float_float.c",
+                   'double': "CL/kernel_double.c",
+                   'perturbation': "CL/kernel_perturbation.c"}
+
+# Scales where 'auto' moves to float-float or double precision and then perturbation, as AppCL does
+FLOAT_CUTOFF = 0.000001
+FLOAT_FLOAT_CUTOFF = 1e-10
+DEEP_ZOOM_CUTOFF = 1e-13
+SERIES_TOLERANCE = 1e-12
+
+# Jobs queued on the device at once, the same number of images are written out in the background
+PIPELINE_DEPTH = 2
+
+
+# One job per line of json, blank lines and lines starting with # are skipped
+# Numbers are read as Decimal so deep zoom centres keep all their digits
+def read_jobs(filename):
+    with open(filename) as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                yield {**JOB_DEFAULTS, **json.loads(line, parse_float=Decimal)}
+
+
+# float_float picks float-float over double where it's precise enough, for gpus without fast doubles
+def get_backend(job, float_float=False):
+    if job['backend'] != 'auto':
+        return job['backend']
+
+    scale = float(job['scale'])
+    if scale >= FLOAT_CUTOFF:
+        return 'float'
+    if job['z_power'] != 2:
+        return 'double'
+    if float_float and scale >= FLOAT_FLOAT_CUTOFF:
+        return 'float_float'
+    return 'perturbation' if scale < DEEP_ZOOM_CUTOFF else 'double'
+
+
+# View extents for a width x height image with square pixels, x spans -2..2 like AppCL
+def get_view_bounds(width, height):
+    return 2, -2, 2 * height / width, -2 * height / width
+
+
+# Scalar arguments and their types for a job on the given backend
+def get_job_args(context, job, backend):
+    xmax, xmin, ymax, ymin = get_view_bounds(job['width'], job['height'])
+    x, y, scale = Decimal(job['x']), Decimal(job['y']), float(job['scale'])
+    depth, z_power, cutoff = int(job['depth']), float(job['z_power']), float(job['cutoff'])
+
+    if backend == 'perturbation':
+        set_decimal_precision(scale)
+        orbit = compute_reference_orbit(x, y, depth, cutoff)
+
+        probes = get_series_probes(xmax, xmin, ymax, ymin, scale, scale)
+        radius = max(abs(probe) for probe in probes)
+        skip, coefficients = compute_series_approximation(orbit, radius, probes, SERIES_TOLERANCE, cutoff)
+
+        scalar_args = get_perturbation_args(create_orbit_buffer(context, orbit), orbit, xmax, xmin, ymax, ymin,
+                                            job['width'], job['height'], scale, scale, depth, cutoff,
+                                            (skip, radius, coefficients))
+        return scalar_args, SCALAR_ARG_TYPES_PERTURBATION
+
+    if backend == 'float_float':
+        scalar_args = (np.float32(xmax),
+                       np.float32(xmin),
+                       np.float32(ymax),
+                       np.float32(ymin),
+                       np.int32(job['width']),
+                       np.int32(job['height']),
+                       split_float_float(x),
+                       split_float_float(y),
+                       split_float_float(scale),
+                       split_float_float(scale),
+                       np.int32(depth),
+                       np.float32(z_power),
+                       np.float32(cutoff))
+        return scalar_args, SCALAR_ARG_TYPES_FLOAT_FLOAT
+
+    floattype = np.float32 if backend == 'float' else np.double
+    scalar_args = (floattype(xmax),
+                   floattype(xmin),
+                   floattype(ymax),
+                   floattype(ymin),
+                   np.int32(job['width']),
+                   np.int32(job['height']),
+                   floattype(float(x)),
+                   floattype(float(y)),
+                   floattype(scale),
+                   floattype(scale),
+                   np.int32(depth),
+                   floattype(z_power),
+                   floattype(cutoff))
+    return scalar_args, SCALAR_ARG_TYPES_GPU if backend == 'float' else SCALAR_ARG_TYPES_CPU
+
+
+# Program for a job's backend, programs holds those already built for the context
+def get_job_program(programs, context, job, backend, out_dtype, interior_check=True, period_tolerance=1e-3):
+    options = create_build_options(interior_check, period_tolerance, out_dtype, z_power=job['z_power'], cutoff=job['cutoff'])
+    program_key = backend, tuple(options)
+    if program_key not in programs:
+        programs[program_key] = create_and_build_program(context, BACKEND_KERNELS[backend], options)
+
+    return programs[program_key]
+
+
+def write_image(filename, out_np, palette):
+    os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+
+    if filename.endswith('.raw'):
+        write_raw(filename, out_np.shape, [(0, out_np)], out_np.dtype)
+    else:
+        write_png(filename, out_np.shape, [(0, out_np)], palette)
+
+
+# Render every job with one context, programs and buffers are reused between jobs with the same settings
+# Up to pipeline jobs are queued on the device while earlier images are written out on other threads
+def render_jobs(jobs, use_gpu=False, out_dir="capture", out_dtype=np.uint32, interior_check=True,
+                period_tolerance=1e-3, pipeline=PIPELINE_DEPTH):
+    context, queue, _ = create_cl_context_and_queue(use_gpu=use_gpu)
+    palette = get_surface_palette()
+
+    programs = {}
+    buffers = {}
+    writes = {}
+    in_flight = []
+    rendered = 0
+
+    def finish_oldest():
+        event, filename, out_np, slot = in_flight.pop(0)
+        event.wait()
+        writes[slot] = writer.submit(write_image, filename, out_np, palette)
+
+    with ThreadPoolExecutor(pipeline) as writer:
+        for index, job in enumerate(jobs):
+            backend = get_backend(job, float_float=use_gpu)
+            program = get_job_program(programs, context, job, backend, out_dtype, interior_check, period_tolerance)
+            scalar_args, scalar_arg_types = get_job_args(context, job, backend)
+
+            # A buffer is free again once the image last rendered into it has been written
+            shape = job['width'], job['height']
+            slot = shape, index % (2 * pipeline)
+            if slot in writes:
+                writes.pop(slot).result()
+            if slot not in buffers:
+                buffers[slot] = create_out_array_and_buffer(context, shape, dtype=out_dtype)
+            out_np, out_buf = buffers[slot]
+
+            calculate_mandelbrot_opencl(queue, program, out_np, out_buf, scalar_args, scalar_arg_types,
+                                        do_copy=False)
+            event = read_out_array(queue, out_np, out_buf, is_blocking=False)
+
+            filename = job.get('output') or os.path.join(out_dir, f"{index:05d}.png")
+            in_flight.append((event, filename, out_np, slot))
+            if len(in_flight) >= pipeline:
+                finish_oldest()
+            rendered += 1
+
+        while in_flight:
+            finish_oldest()
+
+        # Surface any exceptions from the writers
+        for write in writes.values():
+            write.result()
+
+    return rendered
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Render a file of Mandelbrot viewports without a display")
+    parser.add_argument('jobs', help="json lines file, each line has any of x, y, scale, depth, width, height, "
+                                     "z_power, cutoff, backend (auto, float, float_float, double or perturbation) and output")
+    parser.add_argument('--out-dir', default="capture", help="where images go for jobs without an output")
+    parser.add_argument('--gpu', action='store_true', help="render on the gpu instead of the cpu, with float-float before double")
+    parser.add_argument('--dtype', default='uint32', choices=[dtype.name for dtype in OUT_TYPES if dtype.kind in 'iu'],
+                        help="count type the kernels write, and raw outputs are saved as")
+    parser.add_argument('--pipeline', type=int, default=PIPELINE_DEPTH, help="jobs in flight at once")
+    parser.add_argument('--no-interior-check', action='store_true', help="disable the cardioid/bulb and periodicity early-outs")
+    args = parser.parse_args()
+
+    start_time = time.time()
+    rendered = render_jobs(read_jobs(args.jobs), args.gpu, args.out_dir, np.dtype(args.dtype),
+                           not args.no_interior_check, pipeline=args.pipeline)
+    print(f"Rendered {rendered} jobs in {round(time.time() - start_time, 3)}s")
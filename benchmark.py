@@ -0,0 +1,214 @@
+import argparse
+import json
+import multiprocessing as mp
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from decimal import Decimal
+
+# Cold times include compiling, so the kernel caches of pyopencl, pocl and the NVIDIA driver are turned off
+# These are read when pyopencl and the platforms load, so they're set before anything imports pyopencl
+os.environ.setdefault("PYOPENCL_NO_CACHE", "1")
+os.environ.setdefault("POCL_KERNEL_CACHE", "0")
+os.environ.setdefault("CUDA_CACHE_DISABLE", "1")
+
+import numpy as np
+import pyopencl as cl
+
+from CL.mandelbrot_func import create_cl_context_and_queue, create_and_build_program, create_build_options, \
+    create_out_array_and_buffer, calculate_mandelbrot_opencl
+from MP.mandelbrot_func import znplus1, make_tiles
+from batch_render import JOB_DEFAULTS, BACKEND_KERNELS, FLOAT_CUTOFF, FLOAT_FLOAT_CUTOFF, get_view_bounds, get_job_args
+
+try:
+    import resource
+except ImportError:
+    # resource is Unix only, the rss figures are left out on Windows
+    resource = None
+
+# (name, x, y, scale), centred and scaled like AppCL
+VIEWPORTS = [("full_set", "-0.5", "0", 0.7),
+             ("seahorse_valley", "-0.743643887037151", "0.131825904205330", 1e-3),
+             ("deep_interior", "-0.1", "0.05", 1e-3),
+             ("deep_zoom", "-0.743643887037151", "0.131825904205330", 1e-10)]
+
+SIZES = (256, 1024)
+DEPTHS = (250, 1000)
+WARM_REPEATS = 3
+TILE_SIZE = 64
+
+
+def _mp_tile(x0, x1, y0, y1, width, height, x, y, scale, depth):
+    xmax, xmin, ymax, ymin = get_view_bounds(width, height)
+    xs = scale * ((xmax - xmin) * (np.arange(x0, x1) / width) + xmin) + x
+    ys = scale * ((ymax - ymin) * (np.arange(y0, y1) / height) + ymin) + y
+    return znplus1(xs[:, np.newaxis] + 1j * ys, depth=depth, pixel_size=scale * (xmax - xmin) / width)
+
+
+# The multiprocessing path, a pool running znplus1 over tiles of the view
+class MPRenderer:
+    name = 'mp'
+
+    def __init__(self):
+        self.pool = mp.Pool()
+
+    def render(self, x, y, scale, width, height, depth):
+        tiles = make_tiles((width, height), TILE_SIZE)
+        args = [tile + (width, height, float(x), float(y), scale, depth) for tile in tiles]
+
+        counts = np.empty((width, height), dtype=np.uint32)
+        for (x0, x1, y0, y1), tile in zip(tiles, self.pool.starmap(_mp_tile, args)):
+            counts[x0:x1, y0:y1] = tile
+        return counts
+
+    # Counts are the iteration each pixel escaped at, depth if it didn't
+    def iterations(self, counts, depth):
+        return int(np.minimum(counts.astype(np.int64) + 1, depth).sum())
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+
+# An OpenCL backend, the program is built from source, skipping our binary cache as well as the driver caches
+# turned off above, so cold times include compiling
+class CLRenderer:
+    def __init__(self, backend, use_gpu=False):
+        self.name = f"{['cpu', 'gpu'][use_gpu]}_{backend}"
+        self.backend = backend
+        self.context, self.queue, self.device = create_cl_context_and_queue(use_gpu=use_gpu)
+        self.programs = {}
+        self.buffers = {}
+
+    def render(self, x, y, scale, width, height, depth):
+        job = dict(JOB_DEFAULTS, x=x, y=y, scale=scale, width=width, height=height, depth=depth)
+
+        options = create_build_options(out_dtype=np.uint32, z_power=job['z_power'], cutoff=job['cutoff'])
+        if self.backend not in self.programs:
+            self.programs[self.backend] = create_and_build_program(self.context, BACKEND_KERNELS[self.backend], options,
+                                                                   cache_dir=None)
+        if (width, height) not in self.buffers:
+            self.buffers[width, height] = create_out_array_and_buffer(self.context, (width, height), dtype=np.uint32)
+        out_np, out_buf = self.buffers[width, height]
+
+        scalar_args, scalar_arg_types = get_job_args(self.context, job, self.backend)
+        calculate_mandelbrot_opencl(self.queue, self.programs[self.backend], out_np, out_buf, scalar_args, scalar_arg_types)
+        return out_np
+
+    # Counts are the iterations left when each pixel escaped, 0 if it didn't
+    def iterations(self, counts, depth):
+        counts = counts.astype(np.int64)
+        return int(np.where(counts > 0, depth - counts + 1, depth).sum())
+
+    def close(self):
+        pass
+
+
+def get_available_backends():
+    backends = {'mp': MPRenderer,
+                'cpu_float': lambda: CLRenderer('float'),
+                'cpu_float_float': lambda: CLRenderer('float_float'),
+                'cpu_double': lambda: CLRenderer('double')}
+
+    platforms = cl.get_platforms()
+    if platforms and platforms[0].get_devices(device_type=cl.device_type.GPU):
+        backends['gpu_float'] = lambda: CLRenderer('float', use_gpu=True)
+        backends['gpu_float_float'] = lambda: CLRenderer('float_float', use_gpu=True)
+
+    return backends
+
+
+def get_machine_info():
+    info = dict(platform=platform.platform(), python=platform.python_version(), numpy=np.__version__,
+                pyopencl=cl.VERSION_TEXT, cpu_count=os.cpu_count())
+    info['devices'] = [f"{device.name} ({device.driver_version})"
+                       for opencl_platform in cl.get_platforms() for device in opencl_platform.get_devices()]
+    return info
+
+
+# Cold is the first render including creating the backend and compiling its kernel, warm the median of repeats afterwards
+# Peak memory is what this process allocated on the host during a warm render
+def run_benchmark(create_backend, viewport, width, height, depth, repeats=WARM_REPEATS):
+    name, x, y, scale = viewport
+
+    start_time = time.perf_counter()
+    backend = create_backend()
+    counts = backend.render(Decimal(x), Decimal(y), scale, width, height, depth)
+    cold_time = time.perf_counter() - start_time
+
+    warm_times = []
+    tracemalloc.start()
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        counts = backend.render(Decimal(x), Decimal(y), scale, width, height, depth)
+        warm_times.append(time.perf_counter() - start_time)
+    _, peak_host_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    iterations = backend.iterations(counts, depth)
+    backend.close()
+
+    warm_time = statistics.median(warm_times)
+    return dict(viewport=name, backend=backend.name, width=width, height=height, depth=depth,
+                precise=backend.name.endswith('double') or backend.name == 'mp' or scale >= FLOAT_CUTOFF
+                        or backend.name.endswith('float_float') and scale >= FLOAT_FLOAT_CUTOFF,
+                cold_s=round(cold_time, 4), warm_s=round(warm_time, 4), warm_runs=[round(t, 4) for t in warm_times],
+                pixels_per_s=round(width * height / warm_time), iterations=iterations,
+                iterations_per_s=round(iterations / warm_time), peak_host_bytes=peak_host_bytes)
+
+
+def get_result_key(result):
+    return result['viewport'], result['backend'], result['width'], result['height'], result['depth']
+
+
+# Warm time of each result against a previous run, above 1 is faster now
+def compare_results(results, previous):
+    previous = {get_result_key(result): result for result in previous['results']}
+    for result in results:
+        old = previous.get(get_result_key(result))
+        if old:
+            print(f"{' '.join(map(str, get_result_key(result)))}: {old['warm_s']}s -> {result['warm_s']}s, "
+                  f"x{round(old['warm_s'] / result['warm_s'], 2)}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    backends = get_available_backends()
+
+    parser = argparse.ArgumentParser(description="Time every backend on a fixed set of viewports, results as json")
+    parser.add_argument('--backends', nargs='+', default=list(backends), choices=list(backends))
+    parser.add_argument('--viewports', nargs='+', default=[viewport[0] for viewport in VIEWPORTS],
+                        choices=[viewport[0] for viewport in VIEWPORTS])
+    parser.add_argument('--sizes', nargs='+', type=int, default=SIZES, help="square image sizes in pixels")
+    parser.add_argument('--depths', nargs='+', type=int, default=DEPTHS)
+    parser.add_argument('--repeats', type=int, default=WARM_REPEATS, help="warm renders to take the median of")
+    parser.add_argument('--output', default="benchmark.json", help="json file for the results")
+    parser.add_argument('--compare', help="json results of an earlier run to compare against")
+    args = parser.parse_args()
+
+    results = []
+    for viewport in VIEWPORTS:
+        if viewport[0] not in args.viewports:
+            continue
+        for backend in args.backends:
+            for size in args.sizes:
+                for depth in args.depths:
+                    result = run_benchmark(backends[backend], viewport, size, size, depth, args.repeats)
+                    print(f"{viewport[0]} {backend} {size}x{size} depth {depth}: cold {result['cold_s']}s, "
+                          f"warm {result['warm_s']}s, {result['pixels_per_s']} pixels/s", file=sys.stderr)
+                    results.append(result)
+
+    report = dict(machine=get_machine_info(), time=time.strftime("%Y-%m-%dT%H:%M:%S"), results=results)
+    if resource:
+        # Peak resident size of this process and the pool workers over the whole run, in kilobytes on Linux
+        report['max_rss'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        report['max_child_rss'] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare_results(results, json.load(f))
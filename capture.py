@@ -0,0 +1,74 @@
+import struct
+import zlib
+
+import numpy as np
+
+CAPTURE_BAND_HEIGHT = 64
+
+
+# Render a capture height pixels high band by band, reusing band, a (width, band_height) array of counts
+# render_band(y_start, band) fills it, yields (y_start, band) with band trimmed to the rows inside the image
+# With overlap each band also has that many rows of the bands either side of it, render_band gets the first row's y
+def capture_bands(height, band, render_band, overlap=0):
+    band_height = band.shape[1] - 2 * overlap
+
+    for y_start in range(0, height, band_height):
+        render_band(y_start - overlap, band)
+        rows = min(band_height, height - y_start)
+        yield y_start, band[:, :rows + 2 * overlap]
+
+
+# Counts as RGB rows, palette is a (256, 3) uint8 array indexed by the low byte of the count
+# like the 8-bit surface pygame.surfarray.make_surface creates from them, fractional counts are truncated
+def counts_to_rgb_rows(band, palette):
+    return palette[band.T.astype(np.int64) & 0xFF]
+
+
+# Colours pygame gives count values when making a surface from them, indexed by the low byte
+def get_surface_palette():
+    import pygame.surfarray
+
+    palette_surface = pygame.surfarray.make_surface(np.arange(256).reshape(16, 16))
+    return np.array([colour[:3] for colour in palette_surface.get_palette()], dtype=np.uint8)
+
+
+def _png_chunk(f, chunk_type, data):
+    f.write(struct.pack(">I", len(data)))
+    f.write(chunk_type + data)
+    f.write(struct.pack(">I", zlib.crc32(chunk_type + data) & 0xFFFFFFFF))
+
+
+# Stream the bands into an 8-bit RGB png, compressing each band as it arrives
+def write_png(filename, shape, bands, palette):
+    write_png_rgb(filename, shape, ((y_start, counts_to_rgb_rows(band, palette)) for y_start, band in bands))
+
+
+# Same as write_png for bands already coloured, each a (rows, width, 3) uint8 array
+def write_png_rgb(filename, shape, rgb_bands):
+    width, height = shape
+    compressor = zlib.compressobj()
+
+    with open(filename, 'wb') as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        _png_chunk(f, b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+
+        for _, rgb in rgb_bands:
+            rgb = rgb.reshape(rgb.shape[0], width * 3)
+
+            # Each row starts with filter type 0
+            rows = np.zeros((rgb.shape[0], rgb.shape[1] + 1), dtype=np.uint8)
+            rows[:, 1:] = rgb
+
+            data = compressor.compress(rows.tobytes())
+            if data:
+                _png_chunk(f, b"IDAT", data)
+
+        _png_chunk(f, b"IDAT", compressor.flush())
+        _png_chunk(f, b"IEND", b"")
+
+
+# Stream the raw counts to a file, row after row, cast to dtype (uint32 by default)
+def write_raw(filename, shape, bands, dtype=np.uint32):
+    with open(filename, 'wb') as f:
+        for _, band in bands:
+            f.write(np.ascontiguousarray(band.T, dtype=dtype).tobytes())
@@ -0,0 +1,16 @@
+import numpy as np
+
+
+# Shift a frame in place so out[x, y] holds what was at [x + dx, y + dy]
+# Returns the xs, ys of the exposed pixels, which still need computing
+def shift_frame(out, dx, dy):
+    width, height = out.shape
+    src_x, dst_x = slice(max(dx, 0), width + min(dx, 0)), slice(max(-dx, 0), width + min(-dx, 0))
+    src_y, dst_y = slice(max(dy, 0), height + min(dy, 0)), slice(max(-dy, 0), height + min(-dy, 0))
+
+    out[dst_x, dst_y] = out[src_x, src_y]
+
+    exposed = np.ones(out.shape, dtype=bool)
+    exposed[dst_x, dst_y] = False
+
+    return np.nonzero(exposed)
@@ -0,0 +1,51 @@
+import numpy as np
+
+# Rectangles this size or smaller have every pixel computed
+MIN_RECT_SIZE = 8
+
+
+# Render a width x height frame by Mariani-Silver subdivision
+# evaluate(xs, ys) takes integer pixel coordinate arrays and returns their iteration counts
+# Each level computes the borders of all its rectangles in one evaluate call, a rectangle with a uniform border
+# is filled with that value, otherwise it is split in four with children sharing the dividing lines
+# Returns the frame and the number of pixels actually computed
+def mariani_silver(evaluate, shape, dtype=np.int64, min_rect_size=MIN_RECT_SIZE):
+    width, height = shape
+    out = np.zeros(shape, dtype=dtype)
+    known = np.zeros(shape, dtype=bool)
+    pixels_computed = 0
+
+    rects = [(0, width, 0, height)]
+    while rects:
+        # Gather the pixels of this level which haven't been computed yet
+        needed = np.zeros(shape, dtype=bool)
+        for x0, x1, y0, y1 in rects:
+            if x1 - x0 <= min_rect_size or y1 - y0 <= min_rect_size:
+                needed[x0:x1, y0:y1] = True
+            else:
+                needed[x0:x1, [y0, y1 - 1]] = True
+                needed[[x0, x1 - 1], y0:y1] = True
+        needed &= ~known
+
+        xs, ys = np.nonzero(needed)
+        if xs.size:
+            out[xs, ys] = evaluate(xs, ys)
+            known[xs, ys] = True
+            pixels_computed += xs.size
+
+        next_rects = []
+        for x0, x1, y0, y1 in rects:
+            if x1 - x0 <= min_rect_size or y1 - y0 <= min_rect_size:
+                continue
+
+            border = np.concatenate((out[x0:x1, y0], out[x0:x1, y1 - 1], out[x0, y0:y1], out[x1 - 1, y0:y1]))
+            if (border == border[0]).all():
+                out[x0 + 1:x1 - 1, y0 + 1:y1 - 1] = border[0]
+                known[x0 + 1:x1 - 1, y0 + 1:y1 - 1] = True
+            else:
+                xm, ym = (x0 + x1) // 2, (y0 + y1) // 2
+                next_rects += [(x0, xm + 1, y0, ym + 1), (xm, x1, y0, ym + 1),
+                               (x0, xm + 1, ym, y1), (xm, x1, ym, y1)]
+        rects = next_rects
+
+    return out, pixels_computed
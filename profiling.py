@@ -0,0 +1,108 @@
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import pyopencl as cl
+
+# Measurements kept per stage for the rolling stats
+STAGE_WINDOW = 60
+
+_hooks = []
+# Measurements come from the async render and multi-device threads too, this guards the state below
+_lock = threading.Lock()
+_stage_times = {}
+_pending_events = []
+_frame_stages = {}
+_frame_count = 0
+_log_file = None
+
+
+# hook(stage, seconds, kind) is called for every measurement, kind is 'host' or 'device'
+def add_hook(hook):
+    _hooks.append(hook)
+
+
+def remove_hook(hook):
+    _hooks.remove(hook)
+
+
+def record_time(stage, seconds, kind='host'):
+    with _lock:
+        _stage_times.setdefault(stage, deque(maxlen=STAGE_WINDOW)).append(seconds)
+        _frame_stages[stage] = _frame_stages.get(stage, 0) + seconds
+
+    for hook in _hooks:
+        hook(stage, seconds, kind)
+
+
+# Host time of the code inside the with block
+@contextmanager
+def stage(name):
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_time(name, time.perf_counter() - start_time)
+
+
+# Device time of an OpenCL event, read once it has completed, the queue needs PROFILING_ENABLE
+def record_event(name, event):
+    with _lock:
+        _pending_events.append((name, event))
+
+
+def collect_events():
+    global _pending_events
+
+    # Events recorded while these are checked go in the new list
+    with _lock:
+        events, _pending_events = _pending_events, []
+
+    pending = []
+    for name, event in events:
+        if event.command_execution_status == cl.command_execution_status.COMPLETE:
+            try:
+                record_time(name, (event.profile.end - event.profile.start) * 1e-9, 'device')
+            except cl.Error:
+                # From a queue without PROFILING_ENABLE
+                pass
+        else:
+            pending.append((name, event))
+
+    with _lock:
+        _pending_events[:0] = pending
+
+
+# (last, mean, max) seconds of each stage over the last STAGE_WINDOW measurements
+def get_stage_stats():
+    with _lock:
+        return {name: (times[-1], sum(times) / len(times), max(times)) for name, times in _stage_times.items() if times}
+
+
+# Also write each frame's stage totals to filename as a line of json
+def open_profile_log(filename):
+    global _log_file
+    _log_file = open(filename, 'a')
+
+
+def close_profile_log():
+    global _log_file
+    if _log_file:
+        _log_file.close()
+        _log_file = None
+
+
+# Finish the frame's measurements, logging them if there's a log open
+def end_frame():
+    global _frame_stages, _frame_count
+
+    collect_events()
+    with _lock:
+        frame_stages, _frame_stages = _frame_stages, {}
+
+    if _log_file and frame_stages:
+        _log_file.write(json.dumps(dict(frame=_frame_count, time=time.time(), stages=frame_stages)) + "\n")
+
+    _frame_count += 1
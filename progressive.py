@@ -0,0 +1,22 @@
+import numpy as np
+
+# Pixel strides of each refinement pass, each must divide the one before
+PROGRESSIVE_STEPS = (8, 4, 2, 1)
+
+
+# Pixels first computed by a pass with the given step, prev_step skips those computed by the coarser pass before it
+def refinement_points(shape, step, prev_step=None):
+    width, height = shape
+    xs, ys = np.meshgrid(np.arange(0, width, step), np.arange(0, height, step), indexing='ij')
+
+    if prev_step:
+        new = (xs % prev_step != 0) | (ys % prev_step != 0)
+        return xs[new], ys[new]
+
+    return xs.ravel(), ys.ravel()
+
+
+# Fill each step x step block with its top left pixel, for showing a frame that is only computed every step pixels
+def fill_blocks(out, step):
+    width, height = out.shape
+    out[:] = np.repeat(np.repeat(out[::step, ::step], step, axis=0), step, axis=1)[:width, :height]
@@ -0,0 +1,70 @@
+import numpy as np
+
+from capture import counts_to_rgb_rows
+
+# Sub-samples along each side of a boundary pixel, 4 gives 16 samples
+SUPERSAMPLE_GRID = 4
+
+
+# Pixels whose count differs by more than threshold from any of their 8 neighbours,
+# pixels on the edge only compare with those they have
+def boundary_mask(counts, threshold=0):
+    width, height = counts.shape
+    counts = counts.astype(np.int64)
+    padded = np.pad(counts, 1, mode='edge')
+
+    mask = np.zeros(counts.shape, dtype=bool)
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            if dx or dy:
+                mask |= np.abs(padded[1 + dx:1 + dx + width, 1 + dy:1 + dy + height] - counts) > threshold
+    return mask
+
+
+# (n, grid * grid) sub-pixel offsets for each of n pixels, one at a random place in each cell of a grid over the pixel
+# A pixel's count is sampled at its centre so the offsets run from -0.5 to 0.5
+def jittered_offsets(n, grid, rng):
+    cells_x, cells_y = np.meshgrid(np.arange(grid), np.arange(grid), indexing='ij')
+    x_offsets = (cells_x.ravel() + rng.random((n, grid * grid))) / grid - 0.5
+    y_offsets = (cells_y.ravel() + rng.random((n, grid * grid))) / grid - 0.5
+    return x_offsets, y_offsets
+
+
+# RGB rows of counts like capture.counts_to_rgb_rows, with the pixels in mask the average colour of grid x grid
+# jittered sub-samples, evaluate(xs, ys) gives the counts at (fractional) pixel positions offset by origin
+# The sub-samples in the corner cells go first, a pixel where they all match its count has no edge through it
+# and keeps its colour, only the rest get the full grid
+def supersample_rgb(counts, mask, evaluate, palette, grid=SUPERSAMPLE_GRID, origin=(0, 0), rng=None):
+    rgb = counts_to_rgb_rows(counts, palette)
+
+    xs, ys = np.nonzero(mask)
+    if not xs.size:
+        return rgb
+
+    x_offsets, y_offsets = jittered_offsets(xs.size, grid, rng or np.random.default_rng())
+    sample_xs = origin[0] + xs[:, np.newaxis] + x_offsets
+    sample_ys = origin[1] + ys[:, np.newaxis] + y_offsets
+
+    corners = np.array([0, grid - 1, grid * (grid - 1), grid * grid - 1])
+    corner_samples = evaluate(sample_xs[:, corners].ravel(), sample_ys[:, corners].ravel()).reshape(xs.size, 4)
+    edged = np.any(corner_samples != counts[xs, ys][:, np.newaxis], axis=1)
+    if not edged.any():
+        return rgb
+
+    others = np.setdiff1d(np.arange(grid * grid), corners)
+    other_samples = evaluate(sample_xs[edged][:, others].ravel(), sample_ys[edged][:, others].ravel())
+    samples = np.concatenate((corner_samples[edged], other_samples.reshape(-1, others.size)), axis=1)
+
+    colours = palette[samples.astype(np.int64) & 0xFF]
+    rgb[ys[edged], xs[edged]] = np.round(colours.mean(axis=1)).astype(np.uint8)
+    return rgb
+
+
+# RGB bands for capture.write_png_rgb from capture_bands rendered with an overlap of 1
+# The extra rows let boundaries running along the edges between bands be found
+def supersample_bands(bands, evaluate, palette, grid=SUPERSAMPLE_GRID, threshold=0, rng=None):
+    rng = rng or np.random.default_rng()
+
+    for y_start, band in bands:
+        mask = boundary_mask(band, threshold)[:, 1:-1]
+        yield y_start, supersample_rgb(band[:, 1:-1], mask, evaluate, palette, grid, (0, y_start), rng)
@@ -0,0 +1,42 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+# The modules under test live at the top of the repo
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+FRAME_SHAPE = 96, 64
+DEPTH = 64
+
+
+# Counts like the kernels write them, iterations left when z escapes and 0 if it never does,
+# for (possibly fractional) pixel positions in a FRAME_SHAPE frame over -2 to 2
+def mandelbrot_counts(xs, ys, shape=FRAME_SHAPE, depth=DEPTH):
+    width, height = shape
+    c = (4 * np.asarray(xs, dtype=float) / width - 2) + 1j * (4 * np.asarray(ys, dtype=float) / height - 2)
+    z = np.zeros_like(c)
+    counts = np.zeros(c.shape, dtype=np.int64)
+    active = np.ones(c.shape, dtype=bool)
+
+    for count in range(depth, 0, -1):
+        z[active] = z[active] ** 2 + c[active]
+        escaped = active & (np.abs(z) > 2)
+        counts[escaped] = count
+        active &= ~escaped
+
+    return counts
+
+
+# evaluate(xs, ys) like the app passes to the renderers
+@pytest.fixture
+def evaluate():
+    return mandelbrot_counts
+
+
+# The FRAME_SHAPE frame with every pixel computed
+@pytest.fixture
+def frame():
+    xs, ys = np.meshgrid(np.arange(FRAME_SHAPE[0]), np.arange(FRAME_SHAPE[1]), indexing='ij')
+    return mandelbrot_counts(xs, ys)
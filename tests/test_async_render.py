@@ -0,0 +1,99 @@
+import threading
+import time
+
+import pytest
+
+from async_render import AsyncRenderer
+
+
+@pytest.fixture
+def renderer():
+    renderer = AsyncRenderer()
+    yield renderer
+    renderer.close()
+
+
+# A render that blocks until release is set, started is set once the worker is running it
+class BlockingRender:
+    def __init__(self, value):
+        self.value = value
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self):
+        self.started.set()
+        self.release.wait(5)
+        return self.value
+
+
+def poll_until_done(renderer, timeout=5):
+    end_time = time.perf_counter() + timeout
+    while time.perf_counter() < end_time:
+        result = renderer.poll()
+        if result is not None:
+            return result
+        time.sleep(0.001)
+    raise TimeoutError
+
+
+def test_result_is_returned_once(renderer):
+    render_id = renderer.submit(lambda: 42)
+
+    assert poll_until_done(renderer) == (render_id, 42)
+    assert renderer.poll() is None
+
+
+def test_newer_submit_replaces_queued_render(renderer):
+    running = BlockingRender('running')
+    renderer.submit(running)
+    assert running.started.wait(5)
+
+    queued = BlockingRender('queued')
+    renderer.submit(queued)
+    latest_id = renderer.submit(lambda: 'latest')
+    running.release.set()
+
+    assert poll_until_done(renderer) == (latest_id, 'latest')
+    assert not queued.started.is_set()
+
+
+def test_cancel_drops_result_of_running_render(renderer):
+    running = BlockingRender('running')
+    renderer.submit(running)
+    assert running.started.wait(5)
+
+    renderer.cancel()
+    running.release.set()
+    renderer.wait()
+
+    assert renderer.poll() is None
+
+
+def test_wait_after_cancel_blocks_until_worker_is_idle(renderer):
+    running = BlockingRender('running')
+    renderer.submit(running)
+    assert running.started.wait(5)
+    renderer.cancel()
+
+    finished = []
+    def release_later():
+        time.sleep(0.05)
+        finished.append(True)
+        running.release.set()
+    threading.Thread(target=release_later).start()
+
+    renderer.wait()
+    assert finished
+
+
+def test_worker_exception_is_raised_by_poll(renderer):
+    def failing_render():
+        raise ValueError("render failed")
+    renderer.submit(failing_render)
+
+    with pytest.raises(ValueError, match="render failed"):
+        poll_until_done(renderer)
+
+    # The worker carries on after a failed render
+    render_id = renderer.submit(lambda: 'next')
+    assert poll_until_done(renderer) == (render_id, 'next')
@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+
+cl = pytest.importorskip("pyopencl")
+
+from CL.buffer_pool import BufferPool
+
+
+# Stands in for a cl.Buffer, pooled buffers are only asked for their context and released
+class StubBuffer:
+    def __init__(self, context):
+        self.context = context
+        self.released = False
+
+    def release(self):
+        self.released = True
+
+
+def make_pair(context, shape=(16, 16), dtype=np.int64):
+    return np.zeros(shape, dtype=dtype), StubBuffer(context)
+
+
+def test_same_context_shape_and_dtype_get_the_same_pair_back():
+    pool = BufferPool()
+    pair = make_pair("context")
+    pool.put(*pair)
+
+    out_np, out_buf = pool.get("context", (16, 16), np.int64)
+
+    assert out_np is pair[0] and out_buf is pair[1]
+    assert pool._free_bytes == 0
+
+
+def test_pairs_are_only_reused_for_their_own_key():
+    pool = BufferPool()
+    pairs = {key: make_pair(*key) for key in [("a", (16, 16), np.int64), ("b", (16, 16), np.int64),
+                                               ("a", (8, 32), np.int64), ("a", (16, 16), np.uint16)]}
+    for pair in pairs.values():
+        pool.put(*pair)
+
+    for (context, shape, dtype), pair in reversed(pairs.items()):
+        assert pool.get(context, shape, dtype)[1] is pair[1]
+
+
+def test_oldest_pairs_are_released_past_max_bytes():
+    pair_bytes = make_pair("context")[0].nbytes
+    pool = BufferPool(max_bytes=2 * pair_bytes)
+    pairs = [make_pair("context") for _ in range(4)]
+
+    for pair in pairs:
+        pool.put(*pair)
+
+    assert [out_buf.released for _, out_buf in pairs] == [True, True, False, False]
+    assert pool._free_bytes == 2 * pair_bytes
+    assert pool.get("context", (16, 16), np.int64)[1] is pairs[2][1]
+
+
+def test_clear_releases_everything():
+    pool = BufferPool()
+    pairs = [make_pair("context") for _ in range(3)]
+    for pair in pairs:
+        pool.put(*pair)
+
+    pool.clear()
+
+    assert all(out_buf.released for _, out_buf in pairs)
+    assert pool._free_bytes == 0
+
+
+def test_new_pair_is_created_in_the_context():
+    try:
+        context = cl.Context(devices=[cl.get_platforms()[0].get_devices()[0]])
+    except (cl.Error, IndexError):
+        pytest.skip("no OpenCL device")
+    pool = BufferPool()
+
+    out_np, out_buf = pool.get(context, (16, 8), np.uint16)
+
+    assert out_np.shape == (16, 8) and out_np.dtype == np.uint16
+    assert out_buf.context == context and out_buf.size == out_np.nbytes
+    pool.put(out_np, out_buf)
+    assert pool.get(context, (16, 8), np.uint16)[1] is out_buf
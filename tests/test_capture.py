@@ -0,0 +1,72 @@
+import struct
+import zlib
+
+import numpy as np
+import pytest
+
+from capture import capture_bands, counts_to_rgb_rows, write_png, write_raw
+
+
+# render_band for capture_bands from evaluate, rows outside the image are rendered like any other
+def band_renderer(evaluate):
+    def render_band(y_start, band):
+        xs, ys = np.meshgrid(np.arange(band.shape[0]), y_start + np.arange(band.shape[1]), indexing='ij')
+        band[:] = evaluate(xs, ys)
+    return render_band
+
+
+def read_png_rgb(filename, shape):
+    width, height = shape
+    with open(filename, 'rb') as f:
+        data = f.read()
+
+    idat = b""
+    position = 8
+    while position < len(data):
+        length, chunk_type = struct.unpack(">I4s", data[position:position + 8])
+        if chunk_type == b"IDAT":
+            idat += data[position + 8:position + 8 + length]
+        position += 12 + length
+
+    rows = np.frombuffer(zlib.decompress(idat), dtype=np.uint8).reshape(height, width * 3 + 1)
+    assert (rows[:, 0] == 0).all()
+    return rows[:, 1:].reshape(height, width, 3)
+
+
+# Band heights that divide the image, leave a short last band, and cover it in one band
+@pytest.mark.parametrize("band_height", [16, 20, 100])
+def test_bands_match_full_render(evaluate, frame, band_height):
+    band = np.zeros((frame.shape[0], band_height), dtype=frame.dtype)
+
+    rows = [band.copy() for _, band in capture_bands(frame.shape[1], band, band_renderer(evaluate))]
+
+    np.testing.assert_array_equal(np.concatenate(rows, axis=1), frame)
+
+
+def test_overlapping_bands_have_rows_either_side(evaluate, frame):
+    band = np.zeros((frame.shape[0], 20 + 2), dtype=frame.dtype)
+
+    for y_start, band in capture_bands(frame.shape[1], band, band_renderer(evaluate), overlap=1):
+        xs, ys = np.meshgrid(np.arange(frame.shape[0]), np.arange(y_start - 1, y_start - 1 + band.shape[1]), indexing='ij')
+        np.testing.assert_array_equal(band, evaluate(xs, ys))
+        assert y_start + band.shape[1] - 2 <= frame.shape[1]
+
+
+def test_raw_capture_is_uint32_rows(tmp_path, evaluate, frame):
+    filename = tmp_path / "capture.raw"
+    band = np.zeros((frame.shape[0], 16), dtype=frame.dtype)
+
+    write_raw(filename, frame.shape, capture_bands(frame.shape[1], band, band_renderer(evaluate)))
+
+    raw = np.fromfile(filename, dtype=np.uint32).reshape(frame.shape[1], frame.shape[0])
+    np.testing.assert_array_equal(raw.T, frame)
+
+
+def test_png_capture_matches_full_frame_colours(tmp_path, evaluate, frame):
+    filename = tmp_path / "capture.png"
+    palette = np.random.default_rng(0).integers(0, 256, (256, 3), dtype=np.uint8)
+    band = np.zeros((frame.shape[0], 16), dtype=frame.dtype)
+
+    write_png(filename, frame.shape, capture_bands(frame.shape[1], band, band_renderer(evaluate)), palette)
+
+    np.testing.assert_array_equal(read_png_rgb(filename, frame.shape), counts_to_rgb_rows(frame, palette))
@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+
+from incremental_pan import shift_frame
+
+
+# The frame panned by dx, dy pixels, rendered in full
+def render_panned(evaluate, shape, dx, dy):
+    xs, ys = np.meshgrid(np.arange(shape[0]) + dx, np.arange(shape[1]) + dy, indexing='ij')
+    return evaluate(xs, ys)
+
+
+@pytest.mark.parametrize("dx, dy", [(5, 0), (0, -7), (-3, 4), (11, 9), (0, 0)])
+def test_shift_and_strips_match_fresh_render(evaluate, frame, dx, dy):
+    out = frame.copy()
+
+    xs, ys = shift_frame(out, dx, dy)
+    out[xs, ys] = evaluate(xs + dx, ys + dy)
+
+    np.testing.assert_array_equal(out, render_panned(evaluate, frame.shape, dx, dy))
+
+
+def test_only_the_exposed_strips_are_computed(frame):
+    width, height = frame.shape
+
+    xs, ys = shift_frame(frame.copy(), 5, -7)
+
+    assert xs.size == width * height - (width - 5) * (height - 7)
+    assert ((xs >= width - 5) | (ys < 7)).all()
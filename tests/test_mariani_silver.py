@@ -0,0 +1,28 @@
+import numpy as np
+
+from mariani_silver import mariani_silver
+
+
+def test_subdivided_render_matches_direct_render(evaluate, frame):
+    out, pixels_computed = mariani_silver(evaluate, frame.shape, frame.dtype)
+
+    np.testing.assert_array_equal(out, frame)
+    assert pixels_computed < frame.size
+
+
+def test_pixels_computed_counts_evaluated_pixels(evaluate, frame):
+    evaluated = []
+
+    def counting_evaluate(xs, ys):
+        evaluated.extend(zip(xs, ys))
+        return evaluate(xs, ys)
+
+    _, pixels_computed = mariani_silver(counting_evaluate, frame.shape, frame.dtype)
+
+    assert pixels_computed == len(evaluated) == len(set(evaluated))
+
+
+def test_small_frame_is_computed_in_full(evaluate):
+    out, pixels_computed = mariani_silver(evaluate, (6, 5), min_rect_size=8)
+
+    assert pixels_computed == 30
@@ -0,0 +1,35 @@
+import numpy as np
+
+from progressive import PROGRESSIVE_STEPS, refinement_points, fill_blocks
+
+
+def test_passes_compute_every_pixel_once(frame):
+    computed = np.zeros(frame.shape, dtype=np.int64)
+    prev_step = None
+    for step in PROGRESSIVE_STEPS:
+        xs, ys = refinement_points(frame.shape, step, prev_step)
+        computed[xs, ys] += 1
+        prev_step = step
+
+    assert (computed == 1).all()
+
+
+def test_refined_frame_matches_direct_render(evaluate, frame):
+    out = np.zeros_like(frame)
+    prev_step = None
+    for step in PROGRESSIVE_STEPS:
+        xs, ys = refinement_points(frame.shape, step, prev_step)
+        out[xs, ys] = evaluate(xs, ys)
+        fill_blocks(out, step)
+        prev_step = step
+
+    np.testing.assert_array_equal(out, frame)
+
+
+def test_fill_blocks_repeats_top_left_pixels():
+    out = np.zeros((5, 3), dtype=np.int64)
+    out[::2, ::2] = [[1, 2], [3, 4], [5, 6]]
+
+    fill_blocks(out, 2)
+
+    np.testing.assert_array_equal(out, [[1, 1, 2], [1, 1, 2], [3, 3, 4], [3, 3, 4], [5, 5, 6]])
@@ -0,0 +1,72 @@
+import numpy as np
+
+from capture import capture_bands, counts_to_rgb_rows
+from supersample import boundary_mask, jittered_offsets, supersample_rgb, supersample_bands
+
+PALETTE = np.zeros((256, 3), dtype=np.uint8)
+PALETTE[1] = 200, 100, 50
+
+
+# Counts of 1 from row edge_y down, 0 above, for any (fractional) pixel position
+def step_counts(xs, ys, edge_y=16):
+    return (np.asarray(ys) >= edge_y).astype(np.int64)
+
+
+def render_step_band(y_start, band):
+    xs, ys = np.meshgrid(np.arange(band.shape[0]), y_start + np.arange(band.shape[1]), indexing='ij')
+    band[:] = step_counts(xs, ys)
+
+
+def test_boundary_mask_marks_both_sides_of_an_edge():
+    counts = np.zeros((6, 5), dtype=np.uint16)
+    counts[3:, :] = 7
+
+    mask = boundary_mask(counts)
+
+    assert mask[2:4].all()
+    assert not mask[:2].any() and not mask[4:].any()
+    assert not boundary_mask(counts, threshold=7).any()
+
+
+def test_jittered_offsets_take_one_sample_per_cell():
+    x_offsets, y_offsets = jittered_offsets(100, 4, np.random.default_rng(0))
+    cells = np.floor((x_offsets + 0.5) * 4) * 4 + np.floor((y_offsets + 0.5) * 4)
+
+    assert x_offsets.shape == y_offsets.shape == (100, 16)
+    assert (np.sort(cells, axis=1) == np.arange(16)).all()
+
+
+def test_uniform_frame_is_not_resampled():
+    calls = []
+    evaluate = lambda xs, ys: calls.append(xs.size)
+
+    rgb = supersample_rgb(np.full((8, 8), 3), np.zeros((8, 8), dtype=bool), evaluate, PALETTE)
+
+    np.testing.assert_array_equal(rgb, counts_to_rgb_rows(np.full((8, 8), 3), PALETTE))
+    assert not calls
+
+
+def test_pixels_without_an_edge_through_them_keep_their_colour(frame):
+    mask = np.ones(frame.shape, dtype=bool)
+    mask[0] = False
+    # Every corner sample matches when evaluate ignores where in the pixel it's sampled
+    pixel_evaluate = lambda xs, ys: frame[np.floor(xs + 0.5).astype(int), np.floor(ys + 0.5).astype(int)]
+
+    rgb = supersample_rgb(frame, mask, pixel_evaluate, PALETTE)
+
+    np.testing.assert_array_equal(rgb, counts_to_rgb_rows(frame, PALETTE))
+
+
+def test_edge_on_a_band_boundary_is_averaged():
+    width, height = 8, 40
+    band = np.zeros((width, 16 + 2), dtype=np.int64)
+
+    bands = capture_bands(height, band, render_step_band, overlap=1)
+    rgb = np.concatenate([rgb for _, rgb in supersample_bands(bands, step_counts, PALETTE)])
+
+    assert rgb.shape == (height, width, 3)
+    # Row 16 starts the second band, half its samples fall above the edge
+    assert (rgb[16] == (100, 50, 25)).all()
+    # Row 15 is on the boundary too but its samples all lie above the edge
+    plain = counts_to_rgb_rows(step_counts(None, np.tile(np.arange(height), (width, 1))), PALETTE)
+    np.testing.assert_array_equal(np.delete(rgb, 16, axis=0), np.delete(plain, 16, axis=0))
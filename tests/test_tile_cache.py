@@ -0,0 +1,73 @@
+import numpy as np
+
+from tile_cache import TileCache, TILE_SIZE, render_tiles, cache_frame, count_cached_tiles
+
+DEPTH = 64
+VIEW_KEY = ("pixel size", "kernel")
+
+
+def make_tile(value):
+    return np.full((TILE_SIZE, TILE_SIZE), value, dtype=np.int64)
+
+
+def test_least_recently_used_tile_is_evicted():
+    tile_bytes = make_tile(0).nbytes
+    cache = TileCache(2 * tile_bytes)
+
+    cache.put((0, 0), DEPTH, make_tile(1))
+    cache.put((1, 0), DEPTH, make_tile(2))
+    cache.get((0, 0), DEPTH)
+    cache.put((2, 0), DEPTH, make_tile(3))
+
+    assert cache.has((0, 0), DEPTH)
+    assert not cache.has((1, 0), DEPTH)
+    assert cache.has((2, 0), DEPTH)
+    assert cache.nbytes == 2 * tile_bytes
+
+
+def test_evicted_tiles_spill_to_disk_and_load_back(tmp_path):
+    cache = TileCache(make_tile(0).nbytes, str(tmp_path))
+
+    cache.put((0, 0), DEPTH, make_tile(1))
+    cache.put((1, 0), DEPTH, make_tile(2))
+
+    assert list(tmp_path.iterdir())
+    assert list(cache.tiles) == [(1, 0)]
+    np.testing.assert_array_equal(cache.get((0, 0), DEPTH), make_tile(1))
+    assert list(cache.tiles) == [(0, 0)]
+
+
+def test_tiles_serve_lower_depths():
+    cache = TileCache(make_tile(0).nbytes)
+    tile = np.arange(TILE_SIZE * TILE_SIZE, dtype=np.uint16).reshape(TILE_SIZE, TILE_SIZE) % 8
+    cache.put((0, 0), DEPTH, tile)
+
+    assert cache.get((0, 0), DEPTH + 1) is None
+    lower = cache.get((0, 0), DEPTH - 3)
+    np.testing.assert_array_equal(lower, np.where(tile > 3, tile - 3, 0))
+    assert lower.dtype == tile.dtype
+
+
+def test_render_tiles_matches_direct_render(evaluate, frame):
+    cache = TileCache(64 * 1024**2)
+    origin = 10, -20
+    out = np.zeros_like(frame)
+
+    # Pixel positions passed to evaluate are relative to out, the frame's top left is pixel 0, 0
+    pixels_computed = render_tiles(cache, evaluate, out, origin, VIEW_KEY, DEPTH)
+
+    np.testing.assert_array_equal(out, frame)
+    assert pixels_computed >= frame.size
+    assert count_cached_tiles(cache, frame.shape, origin, VIEW_KEY, DEPTH) == len(cache.tiles)
+
+
+def test_cached_frame_is_rendered_without_computing(evaluate, frame):
+    cache = TileCache(64 * 1024**2)
+    cache_frame(cache, frame, (-TILE_SIZE // 2, 0), VIEW_KEY, DEPTH)
+
+    # Only the tiles completely inside the frame are cached, the frame's pixel 32 starts tile 0
+    assert list(cache.tiles) == [(0, 0) + VIEW_KEY]
+
+    out = np.zeros((TILE_SIZE, TILE_SIZE), dtype=frame.dtype)
+    assert render_tiles(cache, evaluate, out, (0, 0), VIEW_KEY, DEPTH) == 0
+    np.testing.assert_array_equal(out, frame[TILE_SIZE // 2:TILE_SIZE // 2 + TILE_SIZE, :TILE_SIZE])
@@ -0,0 +1,32 @@
+from decimal import Decimal
+
+import pytest
+
+pytest.importorskip("pyopencl")
+
+from zoom_animation import get_zoom_frames
+
+START = -0.5, 0.25, 1.5
+END = -0.7436438870371587, 0.1318259042053119, 1e-6
+
+
+def test_frames_run_from_start_to_end():
+    frames = get_zoom_frames(START, END, 30)
+
+    assert len(frames) == 30
+    assert [float(value) for value in frames[0]] == pytest.approx(START)
+    assert [float(value) for value in frames[-1]] == pytest.approx(END)
+
+
+def test_zoom_keeps_its_fixed_point_in_place():
+    (x0, y0, scale0), (x1, y1, scale1) = START, END
+    ratio = Decimal(scale1) / (Decimal(scale0) - Decimal(scale1))
+    fixed_x = Decimal(x1) - (Decimal(x0) - Decimal(x1)) * ratio
+    fixed_y = Decimal(y1) - (Decimal(y0) - Decimal(y1)) * ratio
+
+    # Where the fixed point is on screen, in units of the view's scale
+    positions = [(float((fixed_x - x) / Decimal(scale)), float((fixed_y - y) / Decimal(scale)))
+                 for x, y, scale in get_zoom_frames(START, END, 30)]
+
+    for position in positions:
+        assert position == pytest.approx(positions[0], rel=1e-9)
@@ -0,0 +1,122 @@
+import hashlib
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+TILE_SIZE = 64
+
+
+# LRU cache of iteration count tiles, evicted tiles are written to spill_dir when one is given
+# A tile is stored with the depth it was rendered at and can be served for any lower depth
+class TileCache:
+    def __init__(self, max_bytes, spill_dir=None):
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.nbytes = 0
+        self.tiles = OrderedDict()
+
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+
+    def _spill_path(self, key):
+        return os.path.join(self.spill_dir, hashlib.sha1(repr(key).encode()).hexdigest() + ".npz")
+
+    def _load(self, key):
+        if key in self.tiles:
+            self.tiles.move_to_end(key)
+            return self.tiles[key]
+
+        if self.spill_dir and os.path.exists(self._spill_path(key)):
+            with np.load(self._spill_path(key)) as f:
+                entry = int(f['depth']), f['tile']
+            self._store(key, entry)
+            return entry
+
+        return None
+
+    def _store(self, key, entry):
+        if key in self.tiles:
+            self.nbytes -= self.tiles.pop(key)[1].nbytes
+        self.tiles[key] = entry
+        self.nbytes += entry[1].nbytes
+
+        while self.nbytes > self.max_bytes and len(self.tiles) > 1:
+            old_key, (old_depth, old_tile) = self.tiles.popitem(last=False)
+            self.nbytes -= old_tile.nbytes
+            if self.spill_dir:
+                np.savez(self._spill_path(old_key), depth=old_depth, tile=old_tile)
+
+    def has(self, key, depth):
+        entry = self._load(key)
+        return entry is not None and entry[0] >= depth
+
+    # Counts are iterations left at escape, so a lower depth just subtracts the difference
+    def get(self, key, depth):
+        entry = self._load(key)
+        if entry is None or entry[0] < depth:
+            return None
+
+        tile_depth, tile = entry
+        if tile_depth == depth:
+            return tile
+        # Counts can be unsigned, so don't subtract past 0
+        depth_change = tile_depth - depth
+        return np.where(tile > depth_change, tile - depth_change, 0).astype(tile.dtype)
+
+    def put(self, key, depth, tile):
+        entry = self._load(key)
+        if entry is None or entry[0] < depth:
+            self._store(key, (depth, tile.copy()))
+
+
+# Grid coordinates of the tiles covering a view whose top left pixel is at grid pixel origin
+def tiles_for_view(shape, origin, tile_size=TILE_SIZE):
+    (width, height), (gx0, gy0) = shape, origin
+    return [(tx, ty)
+            for tx in range(gx0 // tile_size, (gx0 + width - 1) // tile_size + 1)
+            for ty in range(gy0 // tile_size, (gy0 + height - 1) // tile_size + 1)]
+
+
+# Fill out from the cache, computing any missing tiles in full with one evaluate(xs, ys) call
+# xs, ys passed to evaluate are pixel positions relative to out, and can be outside it
+# Returns the number of pixels computed
+def render_tiles(cache, evaluate, out, origin, view_key, depth, tile_size=TILE_SIZE):
+    (width, height), (gx0, gy0) = out.shape, origin
+    grid = tiles_for_view(out.shape, origin, tile_size)
+
+    tiles = {tile: cache.get(tile + view_key, depth) for tile in grid}
+    missing = [tile for tile in grid if tiles[tile] is None]
+
+    if missing:
+        offsets = np.arange(tile_size)
+        xs = np.concatenate([np.repeat(tx * tile_size - gx0 + offsets, tile_size) for tx, _ in missing])
+        ys = np.concatenate([np.tile(ty * tile_size - gy0 + offsets, tile_size) for _, ty in missing])
+        counts = evaluate(xs, ys).reshape(len(missing), tile_size, tile_size)
+
+        for tile, tile_counts in zip(missing, counts):
+            cache.put(tile + view_key, depth, tile_counts)
+            tiles[tile] = tile_counts
+
+    for (tx, ty), tile in tiles.items():
+        x0, y0 = tx * tile_size - gx0, ty * tile_size - gy0
+        sx, sy = max(-x0, 0), max(-y0, 0)
+        ex, ey = min(width - x0, tile_size), min(height - y0, tile_size)
+        out[x0 + sx:x0 + ex, y0 + sy:y0 + ey] = tile[sx:ex, sy:ey]
+
+    return len(missing) * tile_size * tile_size
+
+
+# Store the tiles which lie completely inside a rendered frame
+def cache_frame(cache, frame, origin, view_key, depth, tile_size=TILE_SIZE):
+    (width, height), (gx0, gy0) = frame.shape, origin
+
+    for tx, ty in tiles_for_view(frame.shape, origin, tile_size):
+        x0, y0 = tx * tile_size - gx0, ty * tile_size - gy0
+        if x0 >= 0 and y0 >= 0 and x0 + tile_size <= width and y0 + tile_size <= height:
+            cache.put((tx, ty) + view_key, depth, frame[x0:x0 + tile_size, y0:y0 + tile_size])
+
+
+# How many of the tiles covering a view are cached for the given depth
+def count_cached_tiles(cache, shape, origin, view_key, depth, tile_size=TILE_SIZE):
+    return sum(cache.has(tile + view_key, depth) for tile in tiles_for_view(shape, origin, tile_size))
@@ -0,0 +1,176 @@
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+import numpy as np
+
+from CL.mandelbrot_func import create_cl_context_and_queue, create_out_array_and_buffer, calculate_mandelbrot_opencl, read_out_array
+from CL.perturbation import set_decimal_precision
+from batch_render import JOB_DEFAULTS, PIPELINE_DEPTH, get_backend, get_job_args, get_job_program
+from capture import write_png, counts_to_rgb_rows, get_surface_palette
+
+# Keyframes are rendered this many times larger than a frame in each direction, and a little wider than
+# the frame they start at so the frames after it still fit as the centre moves
+KEYFRAME_OVERSAMPLE = 2
+KEYFRAME_MARGIN = 1.1
+# A frame is only taken from a keyframe with at least this many keyframe pixels per frame pixel
+KEYFRAME_MIN_DETAIL = 1.0
+
+
+# Views of a zoom from start to end, each (x, y, scale) with Decimal centres
+# The scale changes geometrically, and the centre linearly with the scale, x1 + (x0 - x1) * (scale - scale1) / (scale0 - scale1)
+# That makes it a zoom about the point x1 - (x0 - x1) * scale1 / (scale0 - scale1), which keeps its place on screen,
+# the end's centre itself only gets to the middle of the screen at the end
+def get_zoom_frames(start, end, frame_count):
+    (x0, y0, scale0), (x1, y1, scale1) = start, end
+    set_decimal_precision(min(scale0, scale1))
+    x0, y0, x1, y1 = Decimal(x0), Decimal(y0), Decimal(x1), Decimal(y1)
+
+    frames = []
+    for i in range(frame_count):
+        t = i / max(frame_count - 1, 1)
+        scale = scale0 * (scale1 / scale0) ** t
+        # Without a change of scale there's no fixed point, the centre just pans
+        weight = (Decimal(scale) - Decimal(scale1)) / (Decimal(scale0) - Decimal(scale1)) if scale0 != scale1 else Decimal(1 - t)
+        frames.append((x1 + (x0 - x1) * weight, y1 + (y0 - y1) * weight, scale))
+
+    return frames
+
+
+# Keyframe pixel positions of a frame's pixel columns and rows, view bounds as in batch_render.get_view_bounds
+def get_keyframe_positions(frame, keyframe, shape, oversample):
+    width, height = shape
+    x, y, scale = frame
+    key_x, key_y, key_scale = keyframe
+
+    positions = []
+    for size, offset in ((width, x - key_x), (height, y - key_y)):
+        unscaled = (4 * np.arange(size) - 2 * size) / width
+        key_unscaled = (scale * unscaled + float(offset)) / key_scale
+        positions.append((key_unscaled * oversample * width + 2 * oversample * size) / 4)
+
+    return positions
+
+
+# A frame can be taken from a keyframe if it lies inside it and the keyframe has enough detail
+def frame_in_keyframe(frame, keyframe, shape, oversample, min_detail):
+    if frame[2] * oversample / keyframe[2] < min_detail:
+        return False
+
+    xs, ys = get_keyframe_positions(frame, keyframe, shape, oversample)
+    return xs[0] >= -0.5 and ys[0] >= -0.5 and xs[-1] <= oversample * shape[0] - 0.5 and ys[-1] <= oversample * shape[1] - 0.5
+
+
+# Group the frames under keyframes, returns [(keyframe, [frame indices])]
+def plan_keyframes(frames, shape, oversample=KEYFRAME_OVERSAMPLE, margin=KEYFRAME_MARGIN, min_detail=KEYFRAME_MIN_DETAIL):
+    plan = []
+    for i, frame in enumerate(frames):
+        if plan and frame_in_keyframe(frame, plan[-1][0], shape, oversample, min_detail):
+            plan[-1][1].append(i)
+        else:
+            x, y, scale = frame
+            plan.append(((x, y, scale * margin), [i]))
+
+    return plan
+
+
+# Counts of a frame, sampled from the nearest keyframe pixels
+def sample_keyframe(key_counts, frame, keyframe, shape, oversample):
+    xs, ys = get_keyframe_positions(frame, keyframe, shape, oversample)
+    xs = np.clip(np.floor(xs + 0.5).astype(np.intp), 0, key_counts.shape[0] - 1)
+    ys = np.clip(np.floor(ys + 0.5).astype(np.intp), 0, key_counts.shape[1] - 1)
+
+    return key_counts[np.ix_(xs, ys)]
+
+
+# Render a zoom from start to end, both (x, y, scale), into output
+# output is a numbered png pattern like capture/zoom/%05d.png, or a .rgb file (- for stdout) of raw rgb24 frames,
+# e.g. for ffmpeg -f rawvideo -pix_fmt rgb24 -s WxH -r 60 -i zoom.rgb zoom.mp4
+# Keyframes are rendered oversample times larger and the frames in between are sampled from them,
+# the next keyframe renders while the frames of the last one are sampled and encoded
+def render_zoom(start, end, frame_count, output, shape=(1024, 1024), depth=JOB_DEFAULTS['depth'], use_gpu=False,
+                out_dtype=np.uint32, interior_check=True, oversample=KEYFRAME_OVERSAMPLE, margin=KEYFRAME_MARGIN,
+                min_detail=KEYFRAME_MIN_DETAIL, pipeline=PIPELINE_DEPTH):
+    context, queue, _ = create_cl_context_and_queue(use_gpu=use_gpu)
+    palette = get_surface_palette()
+
+    frames = get_zoom_frames(start, end, frame_count)
+    plan = plan_keyframes(frames, shape, oversample, margin, min_detail)
+
+    key_shape = oversample * shape[0], oversample * shape[1]
+    buffers = [create_out_array_and_buffer(context, key_shape, dtype=out_dtype) for _ in range(2)]
+    programs = {}
+
+    def enqueue_keyframe(k):
+        x, y, scale = plan[k][0]
+        job = dict(JOB_DEFAULTS, x=x, y=y, scale=scale, depth=depth, width=key_shape[0], height=key_shape[1])
+        backend = get_backend(job, float_float=use_gpu)
+        program = get_job_program(programs, context, job, backend, out_dtype, interior_check)
+        scalar_args, scalar_arg_types = get_job_args(context, job, backend)
+
+        key_counts, key_buf = buffers[k % 2]
+        calculate_mandelbrot_opencl(queue, program, key_counts, key_buf, scalar_args, scalar_arg_types, do_copy=False)
+        return read_out_array(queue, key_counts, key_buf, is_blocking=False)
+
+    # A stream has to be written in order so it gets a single writer
+    is_stream = output == '-' or output.endswith('.rgb')
+    if is_stream:
+        stream = sys.stdout.buffer if output == '-' else open(output, 'wb')
+        write_frame = lambda i, counts: stream.write(counts_to_rgb_rows(counts, palette).tobytes())
+    else:
+        os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+        write_frame = lambda i, counts: write_png(output % i, shape, [(0, counts)], palette)
+
+    with ThreadPoolExecutor(1 if is_stream else pipeline) as writer:
+        writes = []
+        event = enqueue_keyframe(0)
+        for k, (keyframe, frame_indices) in enumerate(plan):
+            next_event = enqueue_keyframe(k + 1) if k + 1 < len(plan) else None
+
+            event.wait()
+            key_counts = buffers[k % 2][0]
+            for i in frame_indices:
+                writes.append(writer.submit(write_frame, i, sample_keyframe(key_counts, frames[i], keyframe, shape, oversample)))
+
+                # Don't let encoding fall too far behind
+                while len(writes) > 4 * pipeline:
+                    writes.pop(0).result()
+
+            event = next_event
+
+        for write in writes:
+            write.result()
+
+    if is_stream and output != '-':
+        stream.close()
+
+    return len(plan)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Render a Mandelbrot zoom between two views as an image sequence or raw video")
+    parser.add_argument('--start', nargs=3, default=["0", "0", "1"], metavar=('X', 'Y', 'SCALE'), help="first view")
+    parser.add_argument('--end', nargs=3, required=True, metavar=('X', 'Y', 'SCALE'), help="last view")
+    parser.add_argument('--frames', type=int, default=600, help="number of frames")
+    parser.add_argument('--size', nargs=2, type=int, default=[1024, 1024], metavar=('WIDTH', 'HEIGHT'))
+    parser.add_argument('--depth', type=int, default=JOB_DEFAULTS['depth'])
+    parser.add_argument('--output', default="capture/zoom/%05d.png",
+                        help="numbered png pattern, or a .rgb file (- for stdout) of raw rgb24 frames")
+    parser.add_argument('--gpu', action='store_true', help="render on the gpu instead of the cpu")
+    parser.add_argument('--oversample', type=int, default=KEYFRAME_OVERSAMPLE, help="keyframe size as a multiple of the frame size")
+    parser.add_argument('--no-reuse', action='store_true', help="render every frame in full")
+    parser.add_argument('--no-interior-check', action='store_true', help="disable the cardioid/bulb and periodicity early-outs")
+    args = parser.parse_args()
+
+    start = Decimal(args.start[0]), Decimal(args.start[1]), float(args.start[2])
+    end = Decimal(args.end[0]), Decimal(args.end[1]), float(args.end[2])
+    reuse = dict(oversample=1, margin=1, min_detail=1) if args.no_reuse else dict(oversample=args.oversample)
+
+    start_time = time.time()
+    keyframes = render_zoom(start, end, args.frames, args.output, tuple(args.size), args.depth, args.gpu,
+                            interior_check=not args.no_interior_check, **reuse)
+    print(f"Rendered {args.frames} frames from {keyframes} keyframes in {round(time.time() - start_time, 3)}s",
+          file=sys.stderr)